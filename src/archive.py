@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# Archive of the raw solver outputs, so that they can be parsed again without
+# running the solvers.
+#
+# File layout:
+#   header:  ARCHIVE_MAGIC
+#   records: the zlib compressed output of each execution, one after another
+#   index:   zlib compressed JSON with the archive metadata and, for each
+#            record, its offset and length and the execution information
+#   footer:  index offset and length (little endian, 8 bytes each) followed
+#            by ARCHIVE_MAGIC
+#
+# Records are compressed independently so that any of them can be read
+# without reading the others.
+#
+
+import collections
+import itertools
+import json
+import mmap
+import struct
+import threading
+import zlib
+
+from parsers import create_parser, build_complete_result, \
+                    build_budget_exceeded_result
+
+
+########################
+#   Module Constants   #
+########################
+
+ARCHIVE_MAGIC = b'DSARCH1\n'
+
+_FOOTER = struct.Struct('<QQ8s')
+
+# Number of records parsed by a worker process at once
+_REPARSE_CHUNK_SIZE = 64
+
+
+####################
+#   Archive Entry  #
+####################
+
+ArchiveEntry = collections.namedtuple(
+    'ArchiveEntry',
+    ['config', 'instance', 'offset', 'length', 'timeout', 'budget_exceeded',
+     'cpu_time', 'peak_memory', 'read_bytes', 'write_bytes']
+)
+
+
+class ArchiveError(Exception):
+    """Raised when a file is not a valid archive."""
+
+
+def compress_output(output):
+    return zlib.compress(output.encode('utf-8'))
+
+
+######################
+#   Archive Writer   #
+######################
+
+class ArchiveWriter:
+    """Appends the compressed outputs of the executions to an archive file.
+
+    Records can be added from several threads. The index is written when the
+    writer is closed, an archive that has not been closed cannot be read.
+    """
+
+    def __init__(self, path, metadata):
+        """
+        :param path: Archive file path, it is overwritten.
+        :param metadata: JSON serializable object stored in the archive
+                         index, e.g., the solvers and their parameters.
+        """
+        self._file = open(path, 'wb')
+        self._file.write(ARCHIVE_MAGIC)
+        self._offset = len(ARCHIVE_MAGIC)
+        self._metadata = metadata
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def add(self, config, instance, compressed_output, timeout,
+            budget_exceeded, cpu_time, peak_memory, read_bytes, write_bytes):
+        """Appends an already compressed output, see compress_output."""
+        with self._lock:
+            self._file.write(compressed_output)
+            self._entries.append(ArchiveEntry(
+                config, instance, self._offset, len(compressed_output),
+                timeout, budget_exceeded, cpu_time, peak_memory, read_bytes,
+                write_bytes))
+            self._offset += len(compressed_output)
+
+    def close(self):
+        """Writes the index and the footer and closes the file."""
+        with self._lock:
+            index = zlib.compress(json.dumps(
+                {'metadata': self._metadata, 'entries': self._entries},
+                separators=(',', ':')).encode('utf-8'))
+            self._file.write(index)
+            self._file.write(_FOOTER.pack(self._offset, len(index),
+                                          ARCHIVE_MAGIC))
+            self._file.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+######################
+#   Archive Reader   #
+######################
+
+class ArchiveReader:
+    """Random access to the records of an archive through mmap."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise ArchiveError("%s is not an archive" % path)
+
+        size = len(self._mmap)
+        if size < len(ARCHIVE_MAGIC) + _FOOTER.size or \
+                self._mmap[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            self.close()
+            raise ArchiveError("%s is not an archive" % path)
+
+        index_offset, index_length, magic = \
+            _FOOTER.unpack(self._mmap[size - _FOOTER.size:])
+        if magic != ARCHIVE_MAGIC or \
+                index_offset + index_length != size - _FOOTER.size:
+            self.close()
+            raise ArchiveError("%s is truncated or has not been closed"
+                               % path)
+
+        try:
+            index = json.loads(zlib.decompress(
+                self._mmap[index_offset:index_offset + index_length])
+                .decode('utf-8'))
+            self.metadata = index['metadata']
+            self.entries = [ArchiveEntry(*e) for e in index['entries']]
+        except (zlib.error, ValueError, KeyError, TypeError) as e:
+            self.close()
+            raise ArchiveError("%s has a corrupted index: %s" % (path, e))
+
+    def read_output(self, entry):
+        """Returns the decompressed output of an entry."""
+        return _read_record(self._mmap, entry.offset, entry.length)
+
+    def close(self):
+        self._mmap.close()
+
+
+###############
+#   Reparse   #
+###############
+
+def reparse_archive(path, parser_name, num_jobs=1):
+    """Parses again the outputs of an archive, in parallel.
+
+    Executions killed by the global timeout have no result, as in the
+    results files written by gen.
+
+    :return: A tuple (metadata, results), where results is the mapping,
+             configuration name -> (instance name -> CompleteSolverResult),
+             in archive order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    reader = ArchiveReader(path)
+    try:
+        metadata, entries = reader.metadata, reader.entries
+    finally:
+        reader.close()
+
+    results = collections.OrderedDict()
+    for entry in entries:
+        results.setdefault(entry.config, collections.OrderedDict())
+
+    # The workers get the location of the records to parse, so that they do
+    # not need to read the index
+    records = [(i, e.offset, e.length, e.timeout)
+               for i, e in enumerate(entries)
+               if not e.timeout or e.budget_exceeded]
+    chunks = [records[i:i + _REPARSE_CHUNK_SIZE]
+              for i in range(0, len(records), _REPARSE_CHUNK_SIZE)]
+
+    with ProcessPoolExecutor(max_workers=num_jobs,
+                             initializer=_init_reparse_worker,
+                             initargs=(path,)) as executor:
+        for chunk in executor.map(_reparse_chunk, chunks,
+                                  itertools.repeat(parser_name)):
+            for i, parsed in chunk:
+                e = entries[i]
+                if e.timeout:
+                    result = build_budget_exceeded_result(
+                        e.cpu_time, e.peak_memory, e.read_bytes,
+                        e.write_bytes)
+                else:
+                    result = build_complete_result(
+                        parsed, e.cpu_time, e.peak_memory, e.read_bytes,
+                        e.write_bytes)
+                results[e.config][e.instance] = result
+
+    return metadata, results
+
+
+def _read_record(archive_mmap, offset, length):
+    return zlib.decompress(archive_mmap[offset:offset + length]) \
+        .decode('utf-8')
+
+
+# Mapped archive of each reparse worker process
+_worker_state = None
+
+
+def _init_reparse_worker(path):
+    global _worker_state
+    with open(path, 'rb') as f:
+        _worker_state = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _reparse_chunk(records, parser_name):
+    """Parses the records given as (entry index, offset, length, timeout)
+    tuples. Timed out records are not parsed.
+
+    Parsers keep state between calls, so each record gets a new one.
+    """
+    return [(i, None if timeout
+             else create_parser(parser_name).parse(
+                 _read_record(_worker_state, offset, length)))
+            for i, offset, length, timeout in records]
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# Resource accounting of whole process trees through cgroup v2.
+#
+# Each execution is placed into its own leaf cgroup, under a per-run parent
+# cgroup, so that the resources used by all the processes it spawns can be
+# read once it finishes (or is killed).
+#
+
+import collections
+import os
+import os.path
+import signal
+import time
+
+
+########################
+#   Module Constants   #
+########################
+
+CGROUP_AUTO = 'auto'
+CGROUP_NONE = 'none'
+
+# Controllers enabled for the job cgroups, if they are available
+_CONTROLLERS = ('cpu', 'memory', 'io')
+
+# Time waiting for a killed cgroup to become empty before removing it
+_REMOVE_TIMEOUT = 5.0
+
+# Parent cgroup path -> (base cgroup, leaf cgroup this process has been moved
+# into or None, controllers enabled in the base cgroup), to undo the setup
+_setups = {}
+
+
+#####################
+#   ResourceUsage   #
+#####################
+
+ResourceUsage = collections.namedtuple(
+    'ResourceUsage',
+    ['cpu_time', 'sys_time', 'peak_memory', 'read_bytes', 'write_bytes']
+)
+
+UNKNOWN_USAGE = ResourceUsage(cpu_time=-1, sys_time=-1, peak_memory=-1,
+                              read_bytes=-1, write_bytes=-1)
+
+
+##########################
+#   Parent cgroup setup  #
+##########################
+
+def create_parent_cgroup(base=CGROUP_AUTO):
+    """Creates the cgroup under which the job cgroups are created.
+
+    The controllers cannot be enabled for the children of a (non-root) cgroup
+    that has processes. In 'auto' mode the base cgroup has at least the
+    current process, which is then moved into a leaf cgroup next to the
+    created one. remove_parent_cgroup moves it back. If the base cgroup has
+    other processes some controllers may still be missing, see
+    get_job_controllers.
+
+    :param base: A cgroup v2 directory delegated to the current user, or
+                 'auto' to use the cgroup of the current process.
+    :return: The path of the created cgroup, or None if cgroup v2 is not
+             available or writable.
+    """
+    if base == CGROUP_NONE:
+        return None
+    auto = base == CGROUP_AUTO
+    if auto:
+        base = get_current_cgroup()
+        if base is None:
+            return None
+
+    if not os.access(os.path.join(base, 'cgroup.procs'), os.W_OK):
+        return None
+
+    path = os.path.join(base, 'diffsolver-{0}'.format(os.getpid()))
+
+    enabled = _enable_controllers(base)
+    leaf = None
+    if auto and _get_missing_controllers(base):
+        leaf = _move_into_leaf(path + '.main')
+        if leaf is not None:
+            enabled += _enable_controllers(base)
+
+    try:
+        os.mkdir(path)
+    except OSError:
+        _undo_setup(base, leaf, enabled)
+        return None
+    _enable_controllers(path)
+
+    _setups[path] = (base, leaf, enabled)
+    return path
+
+
+def remove_parent_cgroup(path):
+    _rmdir(path)
+
+    setup = _setups.pop(path, None)
+    if setup is not None:
+        _undo_setup(*setup)
+
+
+def get_job_controllers(path):
+    """Returns the controllers available to the job cgroups of a parent
+    cgroup. Without 'memory' and 'io' only the cpu time is accounted for
+    through the cgroup, the rest comes from the solver process rusage.
+    """
+    try:
+        return _read(os.path.join(path, 'cgroup.subtree_control')).split()
+    except (IOError, OSError):
+        return []
+
+
+def get_current_cgroup():
+    """Returns the cgroup v2 directory of the current process or None."""
+    mount_point = _get_cgroup2_mount_point()
+    if mount_point is None:
+        return None
+
+    try:
+        with open('/proc/self/cgroup', 'rt') as f:
+            for line in f:
+                hierarchy, _, path = line.rstrip('\n').split(':', 2)
+                if hierarchy == '0':
+                    return os.path.join(mount_point, path.lstrip('/'))
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _get_cgroup2_mount_point():
+    try:
+        with open('/proc/self/mountinfo', 'rt') as f:
+            for line in f:
+                fields = line.split()
+                sep = fields.index('-')
+                if fields[sep + 1] == 'cgroup2':
+                    return fields[4]
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _enable_controllers(path):
+    """Enables the _CONTROLLERS available in a cgroup for its children.
+
+    :return: The controllers enabled by this call.
+    """
+    enabled = []
+    for controller in _get_missing_controllers(path):
+        try:
+            _write(os.path.join(path, 'cgroup.subtree_control'),
+                   '+' + controller)
+            enabled.append(controller)
+        except (IOError, OSError):
+            pass
+    return enabled
+
+
+def _get_missing_controllers(path):
+    """Returns the _CONTROLLERS available in a cgroup but not enabled for its
+    children.
+    """
+    try:
+        available = _read(os.path.join(path, 'cgroup.controllers')).split()
+        active = _read(os.path.join(path, 'cgroup.subtree_control')).split()
+    except (IOError, OSError):
+        return []
+    return [c for c in _CONTROLLERS if c in available and c not in active]
+
+
+def _move_into_leaf(leaf):
+    """Moves the current process into a new leaf cgroup.
+
+    :return: The leaf path, or None if the process cannot be moved.
+    """
+    try:
+        os.mkdir(leaf)
+    except OSError:
+        return None
+
+    try:
+        _write(os.path.join(leaf, 'cgroup.procs'), str(os.getpid()))
+    except (IOError, OSError):
+        _rmdir(leaf)
+        return None
+    return leaf
+
+
+def _undo_setup(base, leaf, enabled):
+    # Processes cannot be moved into a cgroup with controllers enabled for
+    # its children, they are disabled first
+    for controller in enabled:
+        try:
+            _write(os.path.join(base, 'cgroup.subtree_control'),
+                   '-' + controller)
+        except (IOError, OSError):
+            pass
+
+    if leaf is not None:
+        try:
+            _write(os.path.join(base, 'cgroup.procs'), str(os.getpid()))
+        except (IOError, OSError):
+            return
+        _rmdir(leaf)
+
+
+#################
+#   JobCgroup   #
+#################
+
+class JobCgroup:
+    """Leaf cgroup of a single execution."""
+
+    def __init__(self, parent, name):
+        self.path = os.path.join(parent, name)
+        os.mkdir(self.path)
+
+    def attach_current_process(self):
+        """Moves the calling process into the cgroup. Meant to be used as
+        the subprocess preexec_fn, before the solver is executed.
+        """
+        _write(os.path.join(self.path, 'cgroup.procs'), '0')
+
+    def kill(self):
+        """Kills every process in the cgroup."""
+        try:
+            _write(os.path.join(self.path, 'cgroup.kill'), '1')
+            return
+        except (IOError, OSError):  # cgroup.kill requires linux 5.14
+            pass
+
+        for pid in self._read_pids():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def read_usage(self):
+        """Reads the resources used by all the processes of the cgroup."""
+        cpu_stat = self._read_keyed('cpu.stat')
+        cpu_time = cpu_stat['user_usec'] / 10**6 \
+            if 'user_usec' in cpu_stat else -1
+        sys_time = cpu_stat['system_usec'] / 10**6 \
+            if 'system_usec' in cpu_stat else -1
+
+        read_bytes, write_bytes = -1, -1
+        try:
+            with open(os.path.join(self.path, 'io.stat'), 'rt') as f:
+                read_bytes, write_bytes = 0, 0
+                for line in f:  # <major>:<minor> rbytes=N wbytes=N ...
+                    for kv in line.split()[1:]:
+                        key, _, value = kv.partition('=')
+                        if key == 'rbytes':
+                            read_bytes += int(value)
+                        elif key == 'wbytes':
+                            write_bytes += int(value)
+        except (IOError, OSError, ValueError):
+            pass
+
+        return ResourceUsage(cpu_time=cpu_time, sys_time=sys_time,
+                             peak_memory=self._read_int('memory.peak'),
+                             read_bytes=read_bytes, write_bytes=write_bytes)
+
+    def remove(self):
+        """Kills the remaining processes, if any, and removes the cgroup."""
+        deadline = time.monotonic() + _REMOVE_TIMEOUT
+        while self._read_keyed('cgroup.events').get('populated', 0):
+            if time.monotonic() > deadline:
+                return
+            self.kill()
+            time.sleep(0.01)
+
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+    def _read_pids(self):
+        try:
+            with open(os.path.join(self.path, 'cgroup.procs'), 'rt') as f:
+                return [int(pid) for pid in f.read().split()]
+        except (IOError, OSError, ValueError):
+            return []
+
+    def _read_int(self, name):
+        try:
+            with open(os.path.join(self.path, name), 'rt') as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return -1
+
+    def _read_keyed(self, name):
+        values = {}
+        try:
+            with open(os.path.join(self.path, name), 'rt') as f:
+                for line in f:
+                    key, _, value = line.partition(' ')
+                    values[key] = int(value)
+        except (IOError, OSError, ValueError):
+            pass
+        return values
+
+
+def _read(path):
+    with open(path, 'rt') as f:
+        return f.read()
+
+
+def _write(path, value):
+    with open(path, 'wt') as f:
+        f.write(value)
+
+
+def _rmdir(path):
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
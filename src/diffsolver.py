@@ -2,17 +2,28 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import collections
 import itertools
 import os
 import os.path
+import shlex
 import sys
 import threading
 import time
 
 from parsers import create_parser, get_parsers_names, serialize_results, \
-                    deserialize_results, build_complete_result, \
-                    SerializationError, CompleteSolverResult
-from runner import BrokenPoolException, Runner
+                    deserialize_results, deserialize_results_with_metadata, \
+                    build_complete_result, build_budget_exceeded_result, \
+                    must_keep_output, SerializationError, PluginError, \
+                    CompleteSolverResult, KEEP_OUTPUT_CHOICES, \
+                    KEEP_OUTPUT_NEVER
+
+from report import open_report_stream, create_report_writer, DiffSummary, \
+                   Estimate, REPORT_FORMATS, REPORT_FORMAT_TEXT, \
+                   STATUS_ONLY_IN_1, STATUS_ONLY_IN_2
+
+# The runner and cgroups modules are imported by the sub-commands that need
+# them, so that the CLI starts up fast.
 
 
 ##############################
@@ -39,6 +50,11 @@ _EXIT_WORKDIR_ERR = 2
 _EXIT_INSTDIR_ERR = 3
 _EXIT_RESULTS_ERR = 4
 _EXIT_RESULTS_INT = 5
+_EXIT_PLUGIN_ERR = 6
+_EXIT_HISTORY_ERR = 7
+_EXIT_ARCHIVE_ERR = 8
+
+_HISTORY_DATABASE = 'diffsolver.db'
 
 
 ###############################################
@@ -58,6 +74,9 @@ def main():
     except KeyboardInterrupt:
         print("Interrupted by user ... exiting")
         sys.exit(_EXIT_RESULTS_INT)
+    except PluginError as e:
+        print("Error loading parser:", e)
+        sys.exit(_EXIT_PLUGIN_ERR)
 
 
 # Gen sub-command
@@ -67,61 +86,216 @@ def run_gen(opts):
     """Runs the gen sub-command"""
     print_options_summary(opts)
 
-    if not is_executable(opts.solver):
-        print("'%s'" % opts.solver, "is not an executable file ... exiting")
-        sys.exit(_EXIT_BINARY_ERR)
+    for solver in opts.solvers:
+        if not is_executable(solver):
+            print("'%s'" % solver, "is not an executable file ... exiting")
+            sys.exit(_EXIT_BINARY_ERR)
 
     if not opts.instdir or not os.path.isdir(opts.instdir):
         print(opts.instdir, "is not a directory ... exiting")
         sys.exit(_EXIT_INSTDIR_ERR)
 
-    instances = get_instances(opts.instdir, opts.extension)
-    results = evaluate_all_instances(opts.solver, instances, opts.parser,
-                                     opts.num_jobs, opts.solver_parameters,
-                                     opts.timeout)
-
-    if results is not None:
-        print("Serializing", len(results), "results")
-        solver_name = os.path.basename(opts.solver)
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S%z", time.localtime())
-        serialized_result = serialize_results(
-            results, solver=solver_name, timestamp=timestamp, prettify=True)
+    configs = get_solver_configs(opts.solvers, opts.solver_parameters,
+                                 opts.parameter_sets)
+    if len(set(c.name for c in configs)) != len(configs):
+        print("Solvers must have different file names ... exiting")
+        sys.exit(_EXIT_BINARY_ERR)
 
-        results_file = os.path.join(opts.workdir, solver_name + ".results")
-        with open(results_file, 'wt') as f:
-            f.write(serialized_result)
+    instances = iter_instances(opts.instdir, opts.extension)
+    instances_root = os.path.join(opts.instdir, '')
+
+    sample = None
+    if opts.sample:
+        from sampling import draw_stratified_sample
+        baseline = load_results_file_or_exit(opts.sample)
+        sample, cost = draw_stratified_sample(
+            baseline, opts.sample_time * opts.num_jobs / len(configs),
+            opts.sample_seed, opts.timeout)
+        sampled = set(itertools.chain.from_iterable(
+            stratum_instances for _, _, stratum_instances in sample))
+        instances = (path for path in instances
+                     if path.replace(instances_root, '', 1) in sampled)
+        print("Sampled", len(sampled), "of", len(baseline), "instances in",
+              len(sample), "strata, estimated time {0:.0f}s".format(
+                  cost * len(configs) / opts.num_jobs))
+        if cost * len(configs) / opts.num_jobs > opts.sample_time:
+            print("The smallest sample exceeds the sample time, there are "
+                  "too many strata")
+
+    timeouts = None
+    if opts.adaptive_timeout:
+        baseline = load_results_file_or_exit(opts.adaptive_timeout)
+        timeouts = compute_adaptive_timeouts(
+            baseline, opts.timeout_factor, opts.timeout_slack, opts.timeout)
+        print("Using adaptive timeouts for", len(timeouts), "instances")
+
+    stager = None
+    if opts.stage_dir:
+        from staging import InstanceStager
+        stager = InstanceStager(instances, opts.stage_dir,
+                                opts.stage_budget * 2**20,
+                                max_ahead=2 * opts.num_jobs,
+                                uses=len(configs),
+                                decompress=opts.stage_decompress)
+
+    archive = None
+    if opts.archive:
+        from archive import ArchiveWriter
+        archive = ArchiveWriter(opts.archive, {
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S%z",
+                                       time.localtime()),
+            'configs': {c.name: {'solver': os.path.basename(c.solver),
+                                 'parameters': join_parameters(c.parameters)}
+                        for c in configs},
+            'sample': sample,
+        })
+
+    from cgroups import create_parent_cgroup, remove_parent_cgroup, \
+        get_job_controllers
+
+    cgroup = create_parent_cgroup(opts.cgroup)
+    print("Accounting resources with",
+          "cgroup " + cgroup if cgroup else "rusage")
+    if cgroup:
+        controllers = get_job_controllers(cgroup)
+        missing = [c for c in ('memory', 'io') if c not in controllers]
+        if missing:
+            print("The", " and ".join(missing), "cgroup controllers are not "
+                  "available, their usage is the solver process rusage")
+
+    logs_dirs = {c.name: os.path.join(opts.workdir, c.name + ".logs")
+                 for c in configs} \
+        if opts.keep_output != KEEP_OUTPUT_NEVER else None
+    try:
+        results = evaluate_all_instances(configs, instances, instances_root,
+                                         opts.parser, opts.num_jobs,
+                                         opts.timeout,
+                                         opts.worker_parsing,
+                                         opts.keep_output, logs_dirs,
+                                         timeouts, stager, cgroup, archive)
+    finally:
+        if stager is not None:
+            stager.close()
+        if cgroup is not None:
+            remove_parent_cgroup(cgroup)
+        if archive is not None:
+            archive.close()
+            print("Archived", len(archive), "solver outputs into",
+                  opts.archive)
+
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S%z", time.localtime())
+    for config in configs:
+        if logs_dirs and os.path.isdir(logs_dirs[config.name]):
+            print("Solver outputs of", config.name, "written into",
+                  logs_dirs[config.name])
+
+        if results is not None:
+            config_results = results[config.name]
+            print("Serializing", len(config_results), "results of",
+                  config.name)
+            serialized_result = serialize_results(
+                config_results, solver=os.path.basename(config.solver),
+                timestamp=timestamp, prettify=True,
+                parameters=join_parameters(config.parameters), sample=sample)
+
+            results_file = os.path.join(opts.workdir,
+                                        config.name + ".results")
+            with open(results_file, 'wt') as f:
+                f.write(serialized_result)
 
     print("Done!")
 
 
-def evaluate_all_instances(solver, instances, parser, num_jobs,
-                           parameters, timeout):
-    futures, results = [], {}
-    runner = Runner(num_jobs, timeout)
+def evaluate_all_instances(configs, instances, instances_root, parser,
+                           num_jobs, timeout, worker_parsing=False,
+                           keep_output=KEEP_OUTPUT_NEVER, logs_dirs=None,
+                           timeouts=None, stager=None, cgroup=None,
+                           archive=None):
+    """Evaluates every solver configuration on every instance.
+
+    All the (configuration, instance) pairs are scheduled in the same runner,
+    instance by instance, so that the workers are kept busy until the end.
+    Instances are consumed lazily and only a bounded number of executions is
+    pending at any time. Results are keyed by the instance path relative to
+    `instances_root`, even if the solvers are given a staged copy.
+
+    :param logs_dirs: Optional mapping, configuration name -> directory,
+                      where the outputs retained according to `keep_output`
+                      are written as they finish.
+    :param timeouts: Optional mapping, instance name -> timeout, overriding
+                     the global timeout. Instances killed by these timeouts get
+                     an 'exceeded adaptive budget' result.
+    :param stager: Optional InstanceStager of the instances, the staged
+                   files are released as the executions finish.
+    :param cgroup: Optional parent cgroup for the executions accounting.
+    :param archive: Optional ArchiveWriter where the output of every
+                    execution is added.
+    :return: A mapping, configuration name -> results, or None if the
+             evaluation has been interrupted.
+    """
+    from runner import Runner
+
+    timeouts = timeouts or {}
+
+    results = {c.name: {} for c in configs}
+    if worker_parsing:
+        runner = Runner(num_jobs, timeout, parser, keep_output,
+                        cgroup=cgroup, archive_output=archive is not None)
+    else:
+        runner = Runner(num_jobs, timeout, cgroup=cgroup,
+                        archive_output=archive is not None)
     callback = generate_execution_finished_callback(
-        results, parser, get_common_path(instances))
+        results, parser, keep_output, logs_dirs, timeouts)
 
     print("Setting runner task 'has finished' callback")
     runner.add_done_callback(callback)
+    if archive is not None:
+        runner.add_done_callback(generate_archive_callback(archive, timeouts))
+    if stager is not None:
+        runner.add_done_callback(lambda f: stager.release(f.tag.path))
+        staged_instances = stager
+    else:
+        staged_instances = ((path, path) for path in instances)
+
+    def generate_jobs():
+        for instance, path in staged_instances:
+            name = instance.replace(instances_root, '', 1)
+            for config in configs:
+                tag = JobTag(config=config.name, instance=name, path=path)
+                yield (config.solver, path, config.parameters,
+                       timeouts.get(name), tag)
 
     try:
-        print("Enqueuing and waiting {0} evaluations".format(len(instances)))
-        for path in instances:
-            futures.append(runner.run(solver, path, parameters))
+        print("Enqueuing and waiting evaluations")
+        num_submitted = runner.run_all(generate_jobs())
         runner.shutdown(wait=True)
 
         print("")
+        print("Evaluated", num_submitted, "(solver, instance) pairs")
         return results
     except KeyboardInterrupt:
-        for f in futures:
-            f.cancel()
+        runner.cancel()
     finally:
         runner.shutdown(wait=True)
 
     return None
 
 
-def generate_execution_finished_callback(results, parser_name, common_path):
+def generate_execution_finished_callback(results, parser_name,
+                                         keep_output=KEEP_OUTPUT_NEVER,
+                                         logs_dirs=None, budgets=None):
+    """Generates the callback that collects the results of each execution.
+
+    The future tag must be a JobTag. Results are stored in
+    `results`[tag.config] and keyed by tag.instance. The solver output is
+    parsed here unless it has already been parsed by the worker process. If
+    `logs_dirs` is not None, the outputs retained according to `keep_output`
+    are written into `logs_dirs`[tag.config]. Timed out instances with an
+    adaptive timeout in `budgets` are recorded as 'exceeded adaptive budget'
+    results.
+    """
+    from runner import BrokenPoolException
+
     lock = threading.Lock()
 
     def execution_finished_callback(future):
@@ -130,15 +304,34 @@ def generate_execution_finished_callback(results, parser_name, common_path):
                 print("Cancelled {0}".format(future.id))
             else:
                 r = future.result()  # concurrent.futures.Future
-                parser = create_parser(parser_name)
-                if r.timeout:
-                    print("Timeout {0}:".format(future.id), r.instance)
+                tag = future.tag
+                name = tag.instance
+                parsed = r.parsed
+                if r.timeout and budgets and tag.instance in budgets:
+                    print("Budget {0} ({1}):".format(future.id, tag.config),
+                          tag.instance)
+                    with lock:
+                        results[tag.config][name] = \
+                            build_budget_exceeded_result(
+                                r.cpu_time, r.peak_memory, r.read_bytes,
+                                r.write_bytes)
+                elif r.timeout:
+                    print("Timeout {0} ({1}):".format(future.id, tag.config),
+                          tag.instance)
                 else:
-                    print("Success {0}:".format(future.id), r.instance)
+                    print("Success {0} ({1}):".format(future.id, tag.config),
+                          tag.instance)
+                    if parsed is None:
+                        parsed = create_parser(parser_name).parse(r.output)
                     with lock:
-                        name = r.instance.replace(common_path, '', 1)
-                        results[name] = build_complete_result(
-                            parser.parse(r.output), r.cpu_time)
+                        results[tag.config][name] = build_complete_result(
+                            parsed, r.cpu_time, r.peak_memory, r.read_bytes,
+                            r.write_bytes)
+
+                if logs_dirs is not None and r.output and \
+                        must_keep_output(keep_output, r.timeout, parsed):
+                    with lock:
+                        write_output(logs_dirs[tag.config], name, r.output)
 
         except (KeyboardInterrupt, BrokenPoolException):
             print("Execution aborted:", future.id)
@@ -146,72 +339,313 @@ def generate_execution_finished_callback(results, parser_name, common_path):
     return execution_finished_callback
 
 
+def generate_archive_callback(archive, budgets=None):
+    """Generates the callback that adds the output of each execution to the
+    archive, along with what is needed to rebuild its result. The future tag
+    must be a JobTag.
+    """
+    from runner import BrokenPoolException
+
+    def archive_callback(future):
+        try:
+            if not future.cancelled():
+                r = future.result()
+                tag = future.tag
+                archive.add(tag.config, tag.instance, r.compressed_output,
+                            r.timeout,
+                            bool(r.timeout and budgets and
+                                 tag.instance in budgets),
+                            r.cpu_time, r.peak_memory, r.read_bytes,
+                            r.write_bytes)
+        except (KeyboardInterrupt, BrokenPoolException):
+            pass
+
+    return archive_callback
+
+
 # Diff sub-command
 ##############################################################################
 
 def run_diff(opts):
     """Runs the test sub-command"""
-    print_options_summary(opts)
+    if opts.format == REPORT_FORMAT_TEXT and not opts.quiet:
+        print_options_summary(opts)
 
-    results1 = load_results_file_or_exit(opts.results1)
-    results2 = load_results_file_or_exit(opts.results2)
+    metadata1, results1 = load_results_file_or_exit(opts.results1, True)
+    metadata2, results2 = load_results_file_or_exit(opts.results2, True)
     num_different, num_equal, cpu_time1, cpu_time2 = 0, 0, 0.0, 0.0
 
-    all_instances = list(results1.keys() | results2.keys())
-    for instance in all_instances:
-        if instance in results1.keys() and instance in results2.keys():
-            r1, r2 = results1[instance], results2[instance]
+    # If the results come from a sample, only the sampled instances are
+    # compared and the metrics of the whole set are estimated
+    sample = metadata2['sample'] or metadata1['sample']
+    sampled = set(itertools.chain.from_iterable(
+        stratum_instances for _, _, stratum_instances in sample)) \
+        if sample else None
+    differences, times1, times2 = {}, {}, {}
 
-            diff = compute_results_differences(r1, r2, opts.comp_fields)
-            if diff:
-                num_different += 1
-                print("-- DIFFERENT:", instance)
-                print_results_comparison(diff)
+    stream = open_report_stream(opts.output)
+    report = create_report_writer(opts.format, stream)
+    try:
+        all_instances = list(results1.keys() | results2.keys())
+        if sampled is not None:
+            all_instances = [i for i in all_instances if i in sampled]
+        for instance in all_instances:
+            if instance in results1 and instance in results2:
+                r1, r2 = results1[instance], results2[instance]
+
+                diff = compute_results_differences(r1, r2, opts.comp_fields)
+                differences[instance] = 1.0 if diff else 0.0
+                if r1.cpu_time >= 0 and r2.cpu_time >= 0:
+                    times1[instance] = r1.cpu_time
+                    times2[instance] = r2.cpu_time
+                if diff:
+                    num_different += 1
+                    report.write_different(instance, diff)
+                else:
+                    num_equal += 1
+                    cpu_time1 += r1.cpu_time
+                    cpu_time2 += r2.cpu_time
+                    if not opts.quiet:
+                        show_fields = opts.show_fields
+                        to_show = list(zip(show_fields,
+                                           r1.extract_fields(show_fields),
+                                           r2.extract_fields(show_fields)))
+                        report.write_equal(instance, to_show)
+            elif instance in results1:
+                differences[instance] = 1.0
+                report.write_only_in(instance, STATUS_ONLY_IN_1)
             else:
-                num_equal += 1
-                cpu_time1 += r1.cpu_time
-                cpu_time2 += r2.cpu_time
-                print("++ EQUAL:", instance)
-                to_show = list(zip(opts.show_fields,
-                                   r1.extract_fields(opts.show_fields),
-                                   r2.extract_fields(opts.show_fields)))
-                print_results_comparison(to_show)
-        elif instance in results1.keys():
-            print(":: Only in results 1:", instance)
-        elif instance in results2.keys():
-            print(":: Only in results 2:", instance)
-        else:
-            print("WTF:", instance)
+                differences[instance] = 1.0
+                report.write_only_in(instance, STATUS_ONLY_IN_2)
+
+        report.write_summary(DiffSummary(
+            num_results1=len(results1), num_results2=len(results2),
+            num_equal=num_equal, num_different=num_different,
+            avg_time1=cpu_time1 / num_equal if num_equal > 0 else None,
+            avg_time2=cpu_time2 / num_equal if num_equal > 0 else None))
+
+        if sample:
+            report.write_estimates(
+                sum(population for _, population, _ in sample),
+                len(sampled),
+                compute_sample_estimates(sample, differences, times1, times2))
+    finally:
+        report.close()
+        stream.close()
 
-    print("")
-    print("*** # Results on 1:", len(results1), "***")
-    print("*** # Results on 2:", len(results2), "***")
-    print("*** # Equal results:", num_equal, "***")
-    print("*** # Different results:", num_different, "***")
-    print("*** Avg time for equal results (1):",
-          cpu_time1 / num_equal if num_equal > 0 else "--", "***")
-    print("*** Avg time for equal resutls (2):",
-          cpu_time2 / num_equal if num_equal > 0 else "--", "***")
+
+# Reparse sub-command
+##############################################################################
+
+def run_reparse(opts):
+    """Runs the reparse sub-command"""
+    from archive import reparse_archive, ArchiveError
+
+    try:
+        metadata, results = reparse_archive(opts.archive, opts.parser,
+                                            opts.num_jobs)
+    except (ArchiveError, IOError) as e:
+        print("Error reading %s:" % opts.archive, e)
+        sys.exit(_EXIT_ARCHIVE_ERR)
+
+    for name, config_results in results.items():
+        config = metadata['configs'].get(name, {})
+        print("Serializing", len(config_results), "results of", name)
+        serialized_result = serialize_results(
+            config_results, solver=config.get('solver', ""),
+            timestamp=metadata['timestamp'], prettify=True,
+            parameters=config.get('parameters', ""),
+            sample=metadata['sample'])
+
+        results_file = os.path.join(opts.workdir, name + ".results")
+        with open(results_file, 'wt') as f:
+            f.write(serialized_result)
+
+    print("Done!")
+
+
+# Ingest sub-command
+##############################################################################
+
+def run_ingest(opts):
+    """Runs the ingest sub-command"""
+    from history import HistoryError
+
+    store = open_history_store_or_exit(opts)
+    try:
+        for path in opts.results:
+            metadata, results = load_results_file_or_exit(path, True)
+            if not metadata['solver']:
+                metadata['solver'] = os.path.basename(path).rsplit('.', 1)[0]
+            if not metadata['timestamp']:
+                metadata['timestamp'] = time.strftime(
+                    "%Y-%m-%d %H:%M:%S%z",
+                    time.localtime(os.path.getmtime(path)))
+
+            try:
+                run_id = store.ingest(os.path.abspath(path), metadata,
+                                      results)
+            except HistoryError as e:
+                print("Error ingesting %s:" % path, e)
+                sys.exit(_EXIT_HISTORY_ERR)
+            if run_id is None:
+                print("Already ingested:", path)
+            else:
+                print("Ingested", len(results), "results from", path,
+                      "as run", run_id)
+    finally:
+        store.close()
+
+
+# Query sub-command
+##############################################################################
+
+def run_query(opts):
+    """Runs the query sub-command"""
+    from history import HistoryError
+
+    store = open_history_store_or_exit(opts)
+    try:
+        opts.query_func(store, opts)
+    except HistoryError as e:
+        print(e)
+        sys.exit(_EXIT_HISTORY_ERR)
+    finally:
+        store.close()
+
+
+def query_runs(store, opts):
+    print("{0:>6} {1:>24} {2:>20} {3}".format(
+        "run", "timestamp", "solver", "parameters"))
+    for run in store.runs(opts.solver, opts.last, opts.parameters):
+        print("{0:>6} {1:>24} {2:>20} {3}".format(
+            run.id, run.timestamp, run.solver, run.parameters))
+
+
+def query_series(store, opts):
+    print("{0:>6} {1:>24} {2:>20} {3}".format(
+        "run", "timestamp", "solver", opts.field))
+    for row in store.instance_series(opts.instance, opts.field, opts.solver,
+                                     opts.last, opts.parameters):
+        print("{0:>6} {1:>24} {2:>20} {3}".format(
+            row.run_id, row.timestamp, row.solver, row.value))
+
+
+def query_regressions(store, opts):
+    print("{0:>12} {1:>12} {2:>12} {3:>16} {4:>16}  {5}".format(
+        "increase", "cpu_time1", "cpu_time2", "solution1", "solution2",
+        "instance"))
+    for row in store.regressions(opts.run1, opts.run2, opts.top,
+                                 opts.min_time):
+        print("{0:>12.3f} {1:>12.3f} {2:>12.3f} {3:>16} {4:>16}  {5}".format(
+            row.cpu_time2 - row.cpu_time1, row.cpu_time1, row.cpu_time2,
+            row.solution1, row.solution2, row.instance))
+
+
+def query_trends(store, opts):
+    row_format = "{0:>6} {1:>24} {2:>20} {3:>8} {4:>8} {5:>12} {6:>10} {7}"
+    print(row_format.format(
+        "run", "timestamp", "solver", "results", "solved", "avg_time",
+        "change", "parameters"))
+    prev_avgs = {}  # (solver, parameters) -> average time of its last run
+    for run in store.runs(opts.solver, opts.last, opts.parameters):
+        avg = run.total_cpu_time / run.num_timed if run.num_timed else None
+        prev_avg = prev_avgs.get((run.solver, run.parameters))
+        change = "{0:+.1%}".format(avg / prev_avg - 1) \
+            if avg is not None and prev_avg else "--"
+        print(row_format.format(
+            run.id, run.timestamp, run.solver, run.num_results,
+            run.num_solved, "{0:.3f}".format(avg) if avg is not None
+            else "--", change, run.parameters))
+        prev_avgs[(run.solver, run.parameters)] = avg
 
 
 #######################
 #   Utility methods   #
 #######################
 
-def get_instances(directory, extension):
-    """Gather all the instances from the working directory."""
-    instances = []
+SolverConfig = collections.namedtuple(
+    'SolverConfig',
+    ['name', 'solver', 'parameters']
+)
+
+
+# Tag of each submitted job: configuration name, instance name (its path
+# relative to the instances directory) and the path given to the solver.
+JobTag = collections.namedtuple(
+    'JobTag',
+    ['config', 'instance', 'path']
+)
+
+
+def get_solver_configs(solvers, common_parameters, parameter_sets):
+    """Builds the matrix of solver configurations.
+
+    Every solver is combined with every parameter set, the common parameters
+    are prepended to all of them. Configurations are named after the solver
+    file, followed by the parameter set number if there are several.
+    """
+    parameter_sets = [shlex.split(ps) for ps in parameter_sets or ['']]
+
+    configs = []
+    for solver in solvers:
+        solver_name = os.path.basename(solver)
+        for num, parameters in enumerate(parameter_sets, 1):
+            name = solver_name if len(parameter_sets) == 1 \
+                else "{0}.p{1}".format(solver_name, num)
+            configs.append(SolverConfig(name=name, solver=solver,
+                                        parameters=common_parameters +
+                                        parameters))
+    return configs
+
+
+def join_parameters(parameters):
+    return " ".join(shlex.quote(p) for p in parameters)
+
+
+def iter_instances(directory, extension):
+    """Lazily gathers all the instances from the given directory."""
     dot_ext = "." + extension
 
     for root, dirs, files in os.walk(directory):
-        instances.extend(os.path.join(root, f)
-                         for f in files if f.endswith(dot_ext))
-    return instances
+        for f in files:
+            if f.endswith(dot_ext):
+                yield os.path.join(root, f)
+
+
+def compute_adaptive_timeouts(baseline, factor, slack, max_timeout):
+    """Computes the timeout of each instance from its baseline cpu time.
+
+    The timeout of an instance is factor * cpu_time + slack, clamped to
+    max_timeout. Instances without a valid baseline time are not included
+    in the returned mapping, instance name -> timeout.
+    """
+    timeouts = {}
+    for name, result in baseline.items():
+        if result.cpu_time >= 0:
+            timeout = factor * result.cpu_time + slack
+            if timeout < max_timeout:
+                timeouts[name] = timeout
+    return timeouts
+
+
+def write_output(directory, name, output):
+    """Writes a solver output into `directory`/`name`.log"""
+    log_path = os.path.join(directory, name + ".log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, 'wt') as f:
+        f.write(output)
 
 
-def load_results_file_or_exit(file_path):
+def load_results_file_or_exit(file_path, with_metadata=False):
+    """Loads a results file, exiting on error.
+
+    :param with_metadata: If True returns a (metadata, results) tuple.
+    """
     try:
         with open(file_path, "rt") as f:
+            if with_metadata:
+                return deserialize_results_with_metadata(f.read())
             return deserialize_results(f.read())
     except FileNotFoundError:
         print("File not found: %s" % file_path)
@@ -223,13 +657,20 @@ def load_results_file_or_exit(file_path):
         sys.exit(_EXIT_RESULTS_ERR)
 
 
-def is_executable(path):
-    return os.path.isfile(path) and os.access(path, os.X_OK)
+def open_history_store_or_exit(opts):
+    import sqlite3
+    from history import HistoryStore
+
+    path = opts.database or os.path.join(opts.workdir, _HISTORY_DATABASE)
+    try:
+        return HistoryStore(path)
+    except sqlite3.Error as e:
+        print("Error opening %s:" % path, e)
+        sys.exit(_EXIT_HISTORY_ERR)
 
 
-def get_common_path(paths):  # os.path.commonpath requires 3.5+
-    common_prefix = os.path.commonprefix(paths)
-    return os.path.join(os.path.dirname(common_prefix), '')
+def is_executable(path):
+    return os.path.isfile(path) and os.access(path, os.X_OK)
 
 
 def print_options_summary(opts):
@@ -245,6 +686,36 @@ def print_options_summary(opts):
     print("")
 
 
+def compute_sample_estimates(sample, differences, times1, times2):
+    """Estimates the metrics of the whole instance set from the sampled
+    instances.
+
+    :param sample: The sample design, see draw_stratified_sample.
+    :param differences: Mapping, instance name -> 1.0 if its results are
+                        different or it is only in one of the results, e.g.,
+                        because it timed out, and 0.0 otherwise.
+    :param times1: Mapping, instance name -> cpu time in the first results,
+                   of the instances with a valid time in both results.
+    :param times2: Same as times1 for the second results.
+    :return: A list of Estimate.
+    """
+    from sampling import estimate_mean
+
+    metrics = (
+        ('different_fraction', differences),
+        ('avg_time1', times1),
+        ('avg_time2', times2),
+        ('avg_time_change', {i: times2[i] - times1[i] for i in times1}),
+    )
+
+    estimates = []
+    for metric, values in metrics:
+        estimate = estimate_mean(sample, values)
+        if estimate is not None:
+            estimates.append(Estimate(metric, *estimate))
+    return estimates
+
+
 def compute_results_differences(results1, results2, comp_fields):
     differences = []
     for attr in comp_fields:
@@ -256,13 +727,6 @@ def compute_results_differences(results1, results2, comp_fields):
     return differences
 
 
-def print_results_comparison(attr_values):
-    for attr, val_1, val_2 in attr_values:
-        print("***", attr)
-        print("   -- 1:", val_1)
-        print("   -- 2:", val_2)
-
-
 ########################
 #   Argument Parsing   #
 ########################
@@ -314,13 +778,23 @@ def parse_arguments(args):
     # **** Subparser (sub-command) "GEN" ****
     parser_gen = subparsers.add_parser('gen', parents=[base_subparser],
                                        help='Generates a results file.')
-    parser_gen.add_argument('solver', type=str, action='store',
-                            help="Path to the solver executable file.")
+    parser_gen.add_argument('solvers', type=str, nargs='+',
+                            metavar='solver',
+                            help="Path to the solver executable files.")
 
     parser_gen.add_argument('-sp', '--solver_parameters', nargs='*',
                             default=[],
                             help='Parameters to be passed to the solver')
 
+    parser_gen.add_argument('-ps', '--parameter_sets', action='append',
+                            metavar='parameters',
+                            help="Set of solver parameters as a single "
+                                 "string, e.g., -ps='-luby -rinc=2'. Can be "
+                                 "repeated, every solver is run with every "
+                                 "set and a results file is written for each "
+                                 "(solver, set) pair. The --solver_parameters "
+                                 "are prepended to all the sets.")
+
     parser_gen.add_argument('-e', '--extension', type=str, action='store',
                             default='cnf', help="Instance files extension.")
 
@@ -335,7 +809,74 @@ def parse_arguments(args):
                             help="Solver results parser.")
 
     parser_gen.add_argument('-t', '--timeout', type=int, default=30,
-                            help="Evaluations timeout in seconds.")
+                            help="Evaluations timeout in seconds. With "
+                                 "adaptive timeouts, the maximum timeout.")
+
+    parser_gen.add_argument('-sm', '--sample', type=str,
+                            help="Baseline results file used to run only a "
+                                 "stratified sample of its instances, by "
+                                 "directory, solution and cpu time. diff "
+                                 "then estimates the metrics of the whole "
+                                 "set.")
+
+    parser_gen.add_argument('-st', '--sample_time', type=float, default=600,
+                            help="Approximate wall time in seconds of the "
+                                 "sampled evaluation, according to the "
+                                 "baseline times.")
+
+    parser_gen.add_argument('-ss', '--sample_seed', type=int, default=0,
+                            help="Seed of the sample selection.")
+
+    parser_gen.add_argument('-at', '--adaptive_timeout', type=str,
+                            help="Baseline results file used to set each "
+                                 "instance timeout to timeout_factor * "
+                                 "baseline cpu_time + timeout_slack.")
+
+    parser_gen.add_argument('-tf', '--timeout_factor', type=float,
+                            default=3.0,
+                            help="Adaptive timeout baseline time factor.")
+
+    parser_gen.add_argument('-ts', '--timeout_slack', type=float,
+                            default=5.0,
+                            help="Adaptive timeout slack in seconds.")
+
+    parser_gen.add_argument('-sd', '--stage_dir', type=str,
+                            help="Local directory, e.g., /dev/shm, where the "
+                                 "instances are copied ahead of their "
+                                 "execution and deleted afterwards.")
+
+    parser_gen.add_argument('-sb', '--stage_budget', type=int, default=1024,
+                            help="Maximum size in MiB of the staged "
+                                 "instances.")
+
+    parser_gen.add_argument('-sx', '--stage_decompress', action='store_true',
+                            help="Decompress .gz, .bz2, .xz and .lzma "
+                                 "instances while staging them.")
+
+    parser_gen.add_argument('-cg', '--cgroup', type=str, default='auto',
+                            help="cgroup v2 directory under which each "
+                                 "execution gets its own cgroup to account "
+                                 "for all its processes. 'auto' uses the "
+                                 "current cgroup if it is writable, 'none' "
+                                 "only accounts for the solver process.")
+
+    parser_gen.add_argument('-ar', '--archive', type=str,
+                            help="Archive file where the outputs of all the "
+                                 "executions are kept compressed, to parse "
+                                 "them again with the reparse sub-command.")
+
+    parser_gen.add_argument('-wp', '--worker_parsing', action='store_true',
+                            help="Parse the solver outputs in the worker "
+                                 "processes and send back only the parsed "
+                                 "results.")
+
+    parser_gen.add_argument('-ko', '--keep_output',
+                            choices=KEEP_OUTPUT_CHOICES,
+                            default=KEEP_OUTPUT_NEVER,
+                            help="Solver outputs written into "
+                                 "'<workdir>/<solver>.logs'. Failed "
+                                 "executions are those that timed out or "
+                                 "without a solution.")
 
     parser_gen.set_defaults(func=run_gen)
 
@@ -352,7 +893,9 @@ def parse_arguments(args):
     parser_diff.add_argument('-cf', '--comp_fields', nargs='+',
                              action=MultipleChoicesAction,
                              choices=CompleteSolverResult.fields,
-                             default=CompleteSolverResult.fields,
+                             default=[f for f in CompleteSolverResult.fields
+                                      if f not in
+                                      CompleteSolverResult.resource_fields],
                              help="Result fields to compare. Valid Options "
                                   "are: {%s}" % ", "
                                   .join(CompleteSolverResult.fields),
@@ -368,8 +911,112 @@ def parse_arguments(args):
                                   .join(CompleteSolverResult.fields),
                              metavar='fields')
 
+    parser_diff.add_argument('-f', '--format', choices=REPORT_FORMATS,
+                             default=REPORT_FORMAT_TEXT,
+                             help="Report format.")
+
+    parser_diff.add_argument('-o', '--output', type=str, default='-',
+                             help="Report file, '-' for the standard "
+                                  "output.")
+
+    parser_diff.add_argument('-q', '--quiet', action='store_true',
+                             help="Report only the differences and the "
+                                  "summary.")
+
     parser_diff.set_defaults(func=run_diff)
 
+    # **** Subparser (sub-command) "REPARSE" ****
+    parser_reparse = subparsers.add_parser(
+        'reparse', parents=[base_subparser],
+        help='Generates the results files from an archive of solver outputs, '
+             'without running the solvers.')
+
+    parser_reparse.add_argument('archive',
+                                help="Archive written by gen --archive.")
+
+    parser_reparse.add_argument('-p', '--parser', required=True,
+                                choices=get_parsers_names(),
+                                help="Solver results parser.")
+
+    parser_reparse.add_argument('-j', '--num_jobs', type=int, default=1,
+                                help="Number of parallel parsers.")
+
+    parser_reparse.set_defaults(func=run_reparse)
+
+    # **** Shared arguments of the history sub-commands ****
+    history_subparser = argparse.ArgumentParser(add_help=False)
+
+    history_subparser.add_argument('-d', '--database', type=str,
+                                   help="History database file. Defaults to "
+                                        "'<workdir>/%s'." % _HISTORY_DATABASE)
+
+    # **** Subparser (sub-command) "INGEST" ****
+    parser_ingest = subparsers.add_parser(
+        'ingest', parents=[base_subparser, history_subparser],
+        help='Adds results files to the history database.')
+
+    parser_ingest.add_argument('results', nargs='+',
+                               help="Results files to ingest.")
+
+    parser_ingest.set_defaults(func=run_ingest)
+
+    # **** Subparser (sub-command) "QUERY" ****
+    parser_query = subparsers.add_parser(
+        'query', parents=[base_subparser, history_subparser],
+        help='Queries the history database.')
+    parser_query.set_defaults(func=run_query)
+
+    query_subparsers = parser_query.add_subparsers(
+        help='Possible queries are:', dest='query')
+    query_subparsers.required = True
+
+    filter_subparser = argparse.ArgumentParser(add_help=False)
+    filter_subparser.add_argument('-s', '--solver', type=str,
+                                  help="Only the runs of this solver.")
+    filter_subparser.add_argument('-pa', '--parameters', type=str,
+                                  help="Only the runs with these solver "
+                                       "parameters, as in the results "
+                                       "files, e.g., -pa='-luby -rinc=2'.")
+    filter_subparser.add_argument('-n', '--last', type=int,
+                                  help="Only the given number of most "
+                                       "recent runs.")
+
+    query_runs_parser = query_subparsers.add_parser(
+        'runs', parents=[filter_subparser], help='Lists the runs.')
+    query_runs_parser.set_defaults(query_func=query_runs)
+
+    query_series_parser = query_subparsers.add_parser(
+        'series', parents=[filter_subparser],
+        help='Values of a result field of an instance across the runs.')
+    query_series_parser.add_argument('instance',
+                                     help="Instance name, as in the results "
+                                          "files.")
+    query_series_parser.add_argument('-f', '--field', default='cpu_time',
+                                     choices=CompleteSolverResult.fields,
+                                     help="Result field.")
+    query_series_parser.set_defaults(query_func=query_series)
+
+    query_regressions_parser = query_subparsers.add_parser(
+        'regressions',
+        help='Instances whose cpu time increased the most between two runs.')
+    query_regressions_parser.add_argument('run1', type=int,
+                                          help="Reference run id.")
+    query_regressions_parser.add_argument('run2', type=int,
+                                          help="Compared run id.")
+    query_regressions_parser.add_argument('-n', '--top', type=int,
+                                          default=20,
+                                          help="Number of instances.")
+    query_regressions_parser.add_argument('-m', '--min_time', type=float,
+                                          default=0.0,
+                                          help="Ignore the instances faster "
+                                               "than this in both runs.")
+    query_regressions_parser.set_defaults(query_func=query_regressions)
+
+    query_trends_parser = query_subparsers.add_parser(
+        'trends', parents=[filter_subparser],
+        help='Aggregated results of each run.')
+    query_trends_parser.set_defaults(query_func=query_trends)
+
     return parser.parse_args(args)
 
 
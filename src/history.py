@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# Store of the results of many runs, indexed by run and instance, to query
+# how the results evolve over time without parsing the results files again.
+#
+
+import collections
+import datetime
+import hashlib
+import sqlite3
+
+from parsers import CompleteSolverResult
+
+
+########################
+#   Module Constants   #
+########################
+
+# Format of the results files timestamps, the offset is optional
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S%z"
+_LOCAL_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Solutions that count as solved in the run aggregates
+SOLVED_SOLUTIONS = ('SATISFIABLE', 'UNSATISFIABLE', 'OPTIMUM FOUND')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    solver TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    epoch REAL NOT NULL,
+    parameters TEXT NOT NULL,
+    source TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE,
+    num_results INTEGER NOT NULL,
+    num_solved INTEGER NOT NULL,
+    num_timed INTEGER NOT NULL,
+    total_cpu_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_epoch ON runs (epoch);
+
+CREATE TABLE IF NOT EXISTS instances (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    instance_id INTEGER NOT NULL REFERENCES instances (id),
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    conflicts INTEGER,
+    decisions INTEGER,
+    optimum INTEGER,
+    propagations INTEGER,
+    restarts INTEGER,
+    solution TEXT,
+    cpu_time REAL,
+    peak_memory INTEGER,
+    read_bytes INTEGER,
+    write_bytes INTEGER,
+    PRIMARY KEY (instance_id, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_by_run ON results (run_id, instance_id);
+"""
+
+
+###################
+#   Query Rows    #
+###################
+
+RunRow = collections.namedtuple(
+    'RunRow',
+    ['id', 'solver', 'timestamp', 'parameters', 'num_results', 'num_solved',
+     'num_timed', 'total_cpu_time']
+)
+
+SeriesRow = collections.namedtuple(
+    'SeriesRow',
+    ['run_id', 'solver', 'timestamp', 'value']
+)
+
+RegressionRow = collections.namedtuple(
+    'RegressionRow',
+    ['instance', 'cpu_time1', 'cpu_time2', 'solution1', 'solution2']
+)
+
+
+####################
+#   HistoryStore   #
+####################
+
+class HistoryError(Exception):
+    """Raised when the history store cannot fulfill a request."""
+
+
+class HistoryStore:
+    """Results of many runs in an SQLite database.
+
+    Runs are identified by a digest of their metadata and results, so
+    ingesting the same results twice is detected. Per-run aggregates are
+    computed at ingestion time so that trends do not need to scan the
+    results. Runs are sorted by their timestamp converted to UTC.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def ingest(self, source, metadata, results):
+        """Adds the results of a run.
+
+        :param source: Where the results come from, e.g., the file path.
+        :param metadata: Dictionary with the run solver, timestamp and
+                         parameters, as returned by
+                         deserialize_results_with_metadata.
+        :param results: Mapping, instance name -> CompleteSolverResult.
+        :return: The run id, or None if the run is already in the store.
+        """
+        epoch = _parse_timestamp(metadata['timestamp'])
+        valid_times = [r.cpu_time for r in results.values()
+                       if r.cpu_time >= 0]
+        num_solved = sum(1 for r in results.values()
+                         if r.solution in SOLVED_SOLUTIONS)
+
+        digest = hashlib.sha1(repr(
+            (metadata['solver'], metadata['timestamp'],
+             metadata['parameters'], sorted(results.items()))
+        ).encode()).hexdigest()
+
+        with self._db:
+            try:
+                cursor = self._db.execute(
+                    "INSERT INTO runs (solver, timestamp, epoch, parameters,"
+                    " source, digest, num_results, num_solved, num_timed,"
+                    " total_cpu_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (metadata['solver'], metadata['timestamp'], epoch,
+                     metadata['parameters'], source, digest, len(results),
+                     num_solved, len(valid_times), sum(valid_times)))
+            except sqlite3.IntegrityError:
+                return None
+            run_id = cursor.lastrowid
+
+            self._db.executemany(
+                "INSERT OR IGNORE INTO instances (name) VALUES (?)",
+                ((name,) for name in results))
+            self._db.executemany(
+                "INSERT INTO results SELECT id, ?, ?, ?, ?, ?, ?, ?, ?, ?,"
+                " ?, ? FROM instances WHERE name = ?",
+                ((run_id,) + tuple(r) + (name,)
+                 for name, r in results.items()))
+
+        return run_id
+
+    def runs(self, solver=None, last=None, parameters=None):
+        """Returns the runs (RunRow), with their aggregates, sorted by
+        timestamp.
+
+        :param solver: Only the runs of this solver.
+        :param last: Only the given number of most recent runs.
+        :param parameters: Only the runs with these parameters.
+        """
+        where, args = self._run_filter(solver, parameters, " WHERE ")
+        rows = self._db.execute(
+            "SELECT id, solver, timestamp, parameters, num_results,"
+            " num_solved, num_timed, total_cpu_time FROM runs" + where +
+            " ORDER BY epoch DESC, id DESC LIMIT ?",
+            args + (last if last else -1,)).fetchall()
+        return [RunRow(*row) for row in reversed(rows)]
+
+    def instance_series(self, instance, field='cpu_time', solver=None,
+                        last=None, parameters=None):
+        """Returns the values (SeriesRow) of a result field of an instance
+        across the runs, sorted by timestamp.
+        """
+        self._check_field(field)
+        where, args = self._run_filter(solver, parameters, " AND ")
+        rows = self._db.execute(
+            "SELECT runs.id, runs.solver, runs.timestamp, results." + field +
+            " FROM results JOIN runs ON runs.id = results.run_id"
+            " WHERE results.instance_id ="
+            " (SELECT id FROM instances WHERE name = ?)" + where +
+            " ORDER BY runs.epoch DESC, runs.id DESC LIMIT ?",
+            (instance,) + args + (last if last else -1,)).fetchall()
+        return [SeriesRow(*row) for row in reversed(rows)]
+
+    def regressions(self, run1, run2, top=20, min_time=0.0):
+        """Returns the instances (RegressionRow) whose cpu time increased the
+        most from run1 to run2, sorted by decreasing increase.
+
+        :param min_time: Ignore the instances faster than this in both runs.
+        """
+        for run_id in (run1, run2):
+            if self._db.execute("SELECT 1 FROM runs WHERE id = ?",
+                                (run_id,)).fetchone() is None:
+                raise HistoryError("There is no run with id %d" % run_id)
+
+        rows = self._db.execute(
+            "SELECT instances.name, r1.cpu_time, r2.cpu_time, r1.solution,"
+            " r2.solution"
+            " FROM results AS r1"
+            " JOIN results AS r2 ON r2.instance_id = r1.instance_id"
+            " AND r2.run_id = ?"
+            " JOIN instances ON instances.id = r1.instance_id"
+            " WHERE r1.run_id = ? AND r1.cpu_time >= 0 AND r2.cpu_time >= 0"
+            " AND max(r1.cpu_time, r2.cpu_time) >= ?"
+            " AND r2.cpu_time > r1.cpu_time"
+            " ORDER BY r2.cpu_time - r1.cpu_time DESC LIMIT ?",
+            (run2, run1, min_time, top)).fetchall()
+        return [RegressionRow(*row) for row in rows]
+
+    @staticmethod
+    def _check_field(field):
+        if field not in CompleteSolverResult.fields:
+            raise HistoryError("Unknown result field '%s'" % field)
+
+    @staticmethod
+    def _run_filter(solver, parameters, prefix):
+        conditions, args = [], ()
+        if solver:
+            conditions.append("runs.solver = ?")
+            args += (solver,)
+        if parameters is not None:
+            conditions.append("runs.parameters = ?")
+            args += (parameters,)
+        if not conditions:
+            return "", ()
+        return prefix + " AND ".join(conditions), args
+
+
+def _parse_timestamp(timestamp):
+    """Returns the seconds since the epoch of a timestamp, timestamps without
+    an offset are in local time.
+    """
+    for fmt in (TIMESTAMP_FORMAT, _LOCAL_TIMESTAMP_FORMAT):
+        try:
+            return datetime.datetime.strptime(timestamp, fmt).timestamp()
+        except ValueError:
+            pass
+    raise HistoryError("Invalid timestamp '%s', the format must be '%s'"
+                       % (timestamp, TIMESTAMP_FORMAT))
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
-# Add new parsers at the end of this file.
+# Add new parsers in their own module (usually as a spec in solverspecs.py)
+# and register them in _BUILTIN_PARSERS or in a plugin directory manifest
+# (see _load_plugins).
+#
+# Keep the imports of this module light, it is loaded on every invocation.
 #
 
 import abc
 import collections
-import re
-import xml.etree.ElementTree as et
-import xml.dom.minidom
+import importlib
+import os
+import os.path
+import sys
 
 
 ##############################
@@ -28,12 +33,16 @@ class SerializationError(Exception):
     """Raised when (de)serializing incorrectly formatted data."""
 
 
+class PluginError(Exception):
+    """Raised when a parser plugin cannot be found or loaded."""
+
+
 ####################
 #   SolverResult   #
 ####################
 
 ParserSolverResult = collections.namedtuple(
-    '_SolverResult',
+    'ParserSolverResult',
     ['conflicts', 'decisions', 'optimum',
      'propagations', 'restarts', 'solution']
 )
@@ -43,7 +52,7 @@ _SolverResult = collections.namedtuple(
     '_SolverResult',
     ['conflicts', 'decisions', 'optimum',
      'propagations', 'restarts', 'solution',
-     'cpu_time']
+     'cpu_time', 'peak_memory', 'read_bytes', 'write_bytes']
 )
 
 
@@ -51,11 +60,16 @@ class CompleteSolverResult(_SolverResult):
 
     fields = _SolverResult._fields
 
+    # Resources used by the execution, -1 if unknown. They are optional in
+    # the results files and not compared by default.
+    resource_fields = ('peak_memory', 'read_bytes', 'write_bytes')
+
     def extract_fields(self, fields):
         return [getattr(self, field) for field in fields]
 
 
-def build_complete_result(parser_result, cpu_time):
+def build_complete_result(parser_result, cpu_time, peak_memory=-1,
+                          read_bytes=-1, write_bytes=-1):
     return CompleteSolverResult(
         conflicts=parser_result.conflicts,
         decisions=parser_result.decisions,
@@ -63,9 +77,51 @@ def build_complete_result(parser_result, cpu_time):
         propagations=parser_result.propagations,
         restarts=parser_result.restarts,
         solution=parser_result.solution,
-        cpu_time=cpu_time
+        cpu_time=cpu_time,
+        peak_memory=peak_memory,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes
+    )
+
+
+# Solution of the executions killed for exceeding their adaptive timeout
+BUDGET_EXCEEDED_SOLUTION = 'EXCEEDED_ADAPTIVE_BUDGET'
+
+
+def build_budget_exceeded_result(cpu_time, peak_memory=-1, read_bytes=-1,
+                                 write_bytes=-1):
+    return CompleteSolverResult(
+        conflicts=-1, decisions=-1, optimum=-1, propagations=-1, restarts=-1,
+        solution=BUDGET_EXCEEDED_SOLUTION, cpu_time=cpu_time,
+        peak_memory=peak_memory, read_bytes=read_bytes,
+        write_bytes=write_bytes
     )
 
+#################################
+#   Output retention policies   #
+#################################
+
+KEEP_OUTPUT_NEVER = 'never'
+KEEP_OUTPUT_FAILED = 'failed'
+KEEP_OUTPUT_ALWAYS = 'always'
+
+KEEP_OUTPUT_CHOICES = (KEEP_OUTPUT_NEVER, KEEP_OUTPUT_FAILED,
+                       KEEP_OUTPUT_ALWAYS)
+
+
+def must_keep_output(keep_output, timeout, parsed):
+    """Whether the output of an execution must be kept given the policy.
+
+    An execution is considered failed if it timed out or its output could not
+    be parsed into a solution.
+    """
+    if keep_output == KEEP_OUTPUT_ALWAYS:
+        return True
+    elif keep_output == KEEP_OUTPUT_FAILED:
+        return timeout or parsed is None or not parsed.solution
+    return False
+
+
 ##########################################
 #  Parser serialization/deserialization  #
 ##########################################
@@ -75,14 +131,22 @@ _XML_INSTANCE_TAG = 'instance'
 _XML_CONFLICTS_TAG = 'conflicts'
 _XML_DECISIONS_TAG = 'decisions'
 _XML_OPTIMUM_TAG = 'optimum'
+_XML_PARAMETERS_TAG = 'parameters'
+_XML_PEAK_MEMORY_TAG = 'peak_memory'
 _XML_PROPAGATIONS_TAG = 'propagations'
+_XML_READ_BYTES_TAG = 'read_bytes'
 _XML_RESTARTS_TAG = 'restarts'
 _XML_RESULTS_TAG = 'results'
 _XML_RESULT_TAG = 'result'
+_XML_SAMPLE_TAG = 'sample'
+_XML_STRATUM_TAG = 'stratum'
+_XML_KEY_TAG = 'key'
+_XML_POPULATION_TAG = 'population'
 _XML_SOLUTION_TAG = 'solution'
 _XML_SOLVER_TAG = 'solver'
 _XML_CPUTIME_TAG = 'cpu_time'
 _XML_TIMESTAMP_TAG = 'timestamp'
+_XML_WRITE_BYTES_TAG = 'write_bytes'
 
 
 def deserialize_results(serialized_str):
@@ -91,6 +155,20 @@ def deserialize_results(serialized_str):
     :param serialized_str: An XML string with the serialized results.
     :return: A dictionary with the mapping, instnce_name -> SolverResult.
     """
+    return deserialize_results_with_metadata(serialized_str)[1]
+
+
+def deserialize_results_with_metadata(serialized_str):
+    """Deserialize the results and their metadata from the given string.
+
+    :param serialized_str: An XML string with the serialized results.
+    :return: A tuple (metadata, results), where metadata is a dictionary with
+             the solver, timestamp and parameters (empty strings if missing)
+             and the sample design (None if missing, see serialize_results)
+             and results is the mapping, instance_name -> SolverResult.
+    """
+    import xml.etree.ElementTree as et
+
     try:
         root = et.fromstring(serialized_str)
     except et.ParseError as e:
@@ -99,30 +177,54 @@ def deserialize_results(serialized_str):
     if root.tag != _XML_RESULTS_TAG:
         raise SerializationError('Root tag must be %s' % _XML_RESULT_TAG)
 
+    metadata = {}
+    for tag in (_XML_SOLVER_TAG, _XML_TIMESTAMP_TAG, _XML_PARAMETERS_TAG):
+        text = root.findtext(tag)
+        metadata[tag] = text.strip() if text else ""
+    metadata[_XML_SAMPLE_TAG] = _deserialize_sample(
+        root.find(_XML_SAMPLE_TAG))
+
     results = collections.OrderedDict()
     for r in root.findall(_XML_RESULT_TAG):
         instance, result = _deserilize_result(r)
         results[instance] = result
-    return results
+    return metadata, results
 
 
-def serialize_results(results, solver="", timestamp="", prettify=False):
+def serialize_results(results, solver="", timestamp="", prettify=False,
+                      parameters="", sample=None):
     """Serializes the results into an XML formatted string.
 
     :param results: A dictionary whose keys are instance paths and their
                     values SolverResult instances.
     :param solver: The solver used to generate the given results.
     :param timestamp: Time when the results where generated.
+    :param parameters: The parameters passed to the solver.
     :param prettify: Whether the resulting XML must be human readable.
+    :param sample: The sample design if the instances have been sampled, a
+                   list of (stratum key, population, instances) tuples.
 
     :return: An XML formatted string with the provided results.
     """
+    import xml.etree.ElementTree as et
+    import xml.dom.minidom
+
     root = et.Element(_XML_RESULTS_TAG)
 
     if solver:
         et.SubElement(root, _XML_SOLVER_TAG).text = solver
     if timestamp:
         et.SubElement(root, _XML_TIMESTAMP_TAG).text = timestamp
+    if parameters:
+        et.SubElement(root, _XML_PARAMETERS_TAG).text = parameters
+    if sample:
+        sample_element = et.SubElement(root, _XML_SAMPLE_TAG)
+        for key, population, instances in sample:
+            stratum = et.SubElement(sample_element, _XML_STRATUM_TAG)
+            et.SubElement(stratum, _XML_KEY_TAG).text = key
+            et.SubElement(stratum, _XML_POPULATION_TAG).text = str(population)
+            for inst in instances:
+                et.SubElement(stratum, _XML_INSTANCE_TAG).text = inst
 
     for inst, r in results.items():
         result = et.SubElement(root, _XML_RESULT_TAG)
@@ -135,12 +237,35 @@ def serialize_results(results, solver="", timestamp="", prettify=False):
         et.SubElement(result, _XML_RESTARTS_TAG).text = str(r.restarts)
         et.SubElement(result, _XML_SOLUTION_TAG).text = str(r.solution)
         et.SubElement(result, _XML_CPUTIME_TAG).text = str(r.cpu_time)
+        et.SubElement(result, _XML_PEAK_MEMORY_TAG).text = str(r.peak_memory)
+        et.SubElement(result, _XML_READ_BYTES_TAG).text = str(r.read_bytes)
+        et.SubElement(result, _XML_WRITE_BYTES_TAG).text = str(r.write_bytes)
 
     raw_str = et.tostring(root, 'utf-8')
     return raw_str if not prettify else \
         xml.dom.minidom.parseString(raw_str).toprettyxml(indent='    ')
 
 
+def _deserialize_sample(et_sample):
+    if et_sample is None:
+        return None
+
+    sample = []
+    for stratum in et_sample.findall(_XML_STRATUM_TAG):
+        try:
+            key = stratum.findtext(_XML_KEY_TAG).strip()
+            population = int(stratum.findtext(_XML_POPULATION_TAG).strip())
+        except (AttributeError, ValueError):
+            raise SerializationError("Each '%s' tag must contain a '%s' tag "
+                                     "and an integer '%s' tag." %
+                                     (_XML_STRATUM_TAG, _XML_KEY_TAG,
+                                      _XML_POPULATION_TAG))
+        instances = [i.text.strip()
+                     for i in stratum.findall(_XML_INSTANCE_TAG)]
+        sample.append((key, population, instances))
+    return sample
+
+
 def _deserilize_result(et_result):
     def raise_serialization_error(tag):
         raise SerializationError("There must be one and only one '%s' tag in "
@@ -154,6 +279,9 @@ def _deserilize_result(et_result):
     restarts = et_result.findall(_XML_RESTARTS_TAG)
     solution = et_result.findall(_XML_SOLUTION_TAG)
     cpu_time = et_result.findall(_XML_CPUTIME_TAG)
+    peak_memory = et_result.findall(_XML_PEAK_MEMORY_TAG)
+    read_bytes = et_result.findall(_XML_READ_BYTES_TAG)
+    write_bytes = et_result.findall(_XML_WRITE_BYTES_TAG)
 
     if len(instance) != 1:
         raise_serialization_error(_XML_INSTANCE_TAG)
@@ -171,6 +299,12 @@ def _deserilize_result(et_result):
         raise_serialization_error(_XML_SOLUTION_TAG)
     if len(cpu_time) != 1:
         raise_serialization_error(_XML_CPUTIME_TAG)
+    if len(peak_memory) > 1:
+        raise_serialization_error(_XML_PEAK_MEMORY_TAG)
+    if len(read_bytes) > 1:
+        raise_serialization_error(_XML_READ_BYTES_TAG)
+    if len(write_bytes) > 1:
+        raise_serialization_error(_XML_WRITE_BYTES_TAG)
 
     try:
         instance = instance[0].text.strip()
@@ -181,39 +315,113 @@ def _deserilize_result(et_result):
         restarts = int(restarts[0].text.strip())
         solution = solution[0].text.strip() if solution[0].text else ""
         cpu_time = float(cpu_time[0].text.strip())
+        peak_memory = int(peak_memory[0].text.strip()) if peak_memory else -1
+        read_bytes = int(read_bytes[0].text.strip()) if read_bytes else -1
+        write_bytes = int(write_bytes[0].text.strip()) if write_bytes else -1
 
         return instance, \
             CompleteSolverResult(conflicts=conflicts, decisions=decisions,
                                  optimum=optimum, propagations=propagations,
                                  restarts=restarts, solution=solution,
-                                 cpu_time=cpu_time)
+                                 cpu_time=cpu_time, peak_memory=peak_memory,
+                                 read_bytes=read_bytes,
+                                 write_bytes=write_bytes)
     except ValueError:
-        raise SerializationError("Tags '%s, %s, %s, %s and %s' must contain "
-                                 "an integer value." %
+        raise SerializationError("Tags '%s, %s, %s, %s, %s, %s, %s and %s' "
+                                 "must contain an integer value." %
                                  (_XML_CONFLICTS_TAG, _XML_DECISIONS_TAG,
                                   _XML_OPTIMUM_TAG, _XML_PROPAGATIONS_TAG,
-                                  _XML_RESTARTS_TAG))
+                                  _XML_RESTARTS_TAG, _XML_PEAK_MEMORY_TAG,
+                                  _XML_READ_BYTES_TAG, _XML_WRITE_BYTES_TAG))
 
 
 #################################
 #   Parsers Factory Utilities   #
 #################################
 
-_parsers_registry = {}
+# Parsers shipped with diffsolver, as 'module:attribute' references that are
+# only imported when the parser is first created.
+_BUILTIN_PARSERS = {
+    'cadical': 'solverspecs:CaDiCaLParser',
+    'glucose': 'solverspecs:GlucoseParser',
+    'kissat': 'solverspecs:KissatParser',
+    'maxsat': 'solverspecs:MaxSatParser',
+    'minisat': 'solverspecs:MiniSatParser',
+}
+
+# Environment variable with a list of plugin directories (os.pathsep
+# separated). Each directory contains a manifest file whose lines have the
+# form "name = module:attribute", the modules are looked up in the directory.
+PLUGINS_PATH_ENV = 'DIFFSOLVER_PLUGINS_PATH'
+PLUGINS_MANIFEST = 'parsers.manifest'
+
+_parsers_registry = dict(_BUILTIN_PARSERS)
+_plugins_loaded = False
 
 
 def create_parser(name):
-    return _parsers_registry[name]()
+    return get_parser_class(name)()
+
+
+def get_parser_class(name):
+    """Returns the parser class registered as `name`, importing it if it has
+    been registered by reference.
+    """
+    _load_plugins()
+    parser_cls = _parsers_registry[name]
+    if isinstance(parser_cls, str):
+        parser_cls = _import_reference(parser_cls)
+        _parsers_registry[name] = parser_cls
+    return parser_cls
 
 
 def get_parsers_names():
-    return list(_parsers_registry.keys())
+    _load_plugins()
+    return sorted(_parsers_registry.keys())
 
 
 def register_parser(name, parser_cls):
+    """Registers a parser class or a 'module:attribute' reference to it."""
     _parsers_registry[name] = parser_cls
 
 
+def _import_reference(reference):
+    module_name, _, attr_name = reference.partition(':')
+    try:
+        return getattr(importlib.import_module(module_name), attr_name)
+    except (ImportError, AttributeError) as e:
+        raise PluginError("Cannot load parser '%s': %s" % (reference, e))
+
+
+def _load_plugins():
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+
+    for directory in os.environ.get(PLUGINS_PATH_ENV, '').split(os.pathsep):
+        manifest = os.path.join(directory, PLUGINS_MANIFEST)
+        if directory and os.path.isfile(manifest):
+            for name, reference in _read_manifest(manifest):
+                register_parser(name, reference)
+            if directory not in sys.path:
+                sys.path.append(directory)
+
+
+def _read_manifest(manifest):
+    with open(manifest, 'rt') as f:
+        for num, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+
+            name, sep, reference = (s.strip() for s in line.partition('='))
+            if not sep or not name or ':' not in reference:
+                raise PluginError("%s:%d: expected 'name = module:attribute'"
+                                  % (manifest, num))
+            yield name, reference
+
+
 #######################
 #   Abstract Parser   #
 #######################
@@ -261,73 +469,3 @@ class AbstractSolverParser(metaclass=abc.ABCMeta):
             optimum=self.optimum, propagations=self.propagations,
             restarts=self.restarts, solution=self.solution
         )
-
-
-######################
-#   MiniSat Parser   #
-######################
-
-_MINISAT_CONF_RE = re.compile(r'conflicts\s*:\s*(\d+)[\s\S]*')
-_MINISAT_DECS_RE = re.compile(r'decisions\s*:\s*(\d+)[\s\S]*')
-_MINISAT_PROPS_RE = re.compile(r'propagations\s*:\s*(\d+)[\s\S]*')
-_MINISAT_RESTARTS_RE = re.compile(r'restarts\s*:\s*(\d+)[\s\S]*')
-_MINISAT_SOL_RE = re.compile(r'(INDETERMINATE|(?:UN)?SATISFIABLE)\s*')
-
-
-class MiniSatParser(AbstractSolverParser):
-
-    def __init__(self):
-        self._conflicts = -1
-        self._decisions = -1
-        self._propagations = -1
-        self._restarts = -1
-        self._solution = ""
-
-    @property
-    def conflicts(self):
-        return self._conflicts
-
-    @property
-    def decisions(self):
-        return self._decisions
-
-    @property
-    def optimum(self):
-        return -1
-
-    @property
-    def propagations(self):
-        return self._propagations
-
-    @property
-    def restarts(self):
-        return self._restarts
-
-    @property
-    def solution(self):
-        return self._solution
-
-    def parse(self, text):
-        conf_match = _MINISAT_CONF_RE.search(text)
-        decs_match = _MINISAT_DECS_RE.search(text)
-        props_match = _MINISAT_PROPS_RE.search(text)
-        restarts_match = _MINISAT_RESTARTS_RE.search(text)
-        solution_match = _MINISAT_SOL_RE.search(text)
-
-        if conf_match:
-            self._conflicts = int(conf_match.group(1))
-        if decs_match:
-            self._decisions = int(decs_match.group(1))
-        if props_match:
-            self._propagations = int(props_match.group(1))
-        if restarts_match:
-            self._restarts = int(restarts_match.group(1))
-        if solution_match:
-            self._solution = solution_match.group(1)
-
-        return self.get_result()
-
-
-#
-# Register MiniSat Parser Class
-register_parser('minisat', MiniSatParser)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# Writers of the diff sub-command report.
+#
+
+import abc
+import collections
+import sys
+
+
+########################
+#   Module Constants   #
+########################
+
+# Size of the output buffer, reports are written in large chunks
+REPORT_BUFFER_SIZE = 1 << 20
+
+REPORT_FORMAT_TEXT = 'text'
+REPORT_FORMAT_JSONL = 'jsonl'
+REPORT_FORMAT_CSV = 'csv'
+
+REPORT_FORMATS = (REPORT_FORMAT_TEXT, REPORT_FORMAT_JSONL, REPORT_FORMAT_CSV)
+
+STATUS_EQUAL = 'equal'
+STATUS_DIFFERENT = 'different'
+STATUS_ONLY_IN_1 = 'only_in_1'
+STATUS_ONLY_IN_2 = 'only_in_2'
+STATUS_SUMMARY = 'summary'
+STATUS_ESTIMATE = 'estimate'
+
+
+###############
+#   Summary   #
+###############
+
+DiffSummary = collections.namedtuple(
+    'DiffSummary',
+    ['num_results1', 'num_results2', 'num_equal', 'num_different',
+     'avg_time1', 'avg_time2']
+)
+
+# Estimate of a metric over the whole instance set, from a stratified
+# sample, with its 95% confidence interval
+Estimate = collections.namedtuple(
+    'Estimate',
+    ['metric', 'value', 'ci_low', 'ci_high']
+)
+
+
+#########################
+#   Report Utilities    #
+#########################
+
+def open_report_stream(path=None):
+    """Opens a text stream with a large buffer to write a report.
+
+    :param path: File path, if None or '-' the standard output is used.
+    """
+    if path is None or path == '-':
+        sys.stdout.flush()
+        return open(sys.stdout.fileno(), 'wt', buffering=REPORT_BUFFER_SIZE,
+                    encoding=sys.stdout.encoding, newline='',
+                    closefd=False)
+    return open(path, 'wt', buffering=REPORT_BUFFER_SIZE, newline='')
+
+
+def create_report_writer(report_format, stream):
+    return _report_writers[report_format](stream)
+
+
+###############################
+#   Abstract Report Writer    #
+###############################
+
+class AbstractReportWriter(metaclass=abc.ABCMeta):
+    """Writes the comparison of two results files into a text stream.
+
+    The attribute values passed to the write methods are sequences of
+    (attribute, value_1, value_2) tuples.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    @abc.abstractmethod
+    def write_equal(self, instance, attr_values):
+        raise NotImplementedError("Abstract method.")
+
+    @abc.abstractmethod
+    def write_different(self, instance, attr_values):
+        raise NotImplementedError("Abstract method.")
+
+    @abc.abstractmethod
+    def write_only_in(self, instance, status):
+        raise NotImplementedError("Abstract method.")
+
+    @abc.abstractmethod
+    def write_summary(self, summary):
+        raise NotImplementedError("Abstract method.")
+
+    @abc.abstractmethod
+    def write_estimates(self, population, sample_size, estimates):
+        """Writes the estimates (Estimate) of the metrics over the
+        population of a sample.
+        """
+        raise NotImplementedError("Abstract method.")
+
+    def close(self):
+        self._stream.flush()
+
+
+##########################
+#   Text Report Writer   #
+##########################
+
+class TextReportWriter(AbstractReportWriter):
+
+    def write_equal(self, instance, attr_values):
+        self._stream.write("++ EQUAL: %s\n" % instance)
+        self._write_attr_values(attr_values)
+
+    def write_different(self, instance, attr_values):
+        self._stream.write("-- DIFFERENT: %s\n" % instance)
+        self._write_attr_values(attr_values)
+
+    def write_only_in(self, instance, status):
+        which = 1 if status == STATUS_ONLY_IN_1 else 2
+        self._stream.write(":: Only in results %d: %s\n" % (which, instance))
+
+    def write_summary(self, summary):
+        avg_time1 = summary.avg_time1 if summary.avg_time1 is not None \
+            else "--"
+        avg_time2 = summary.avg_time2 if summary.avg_time2 is not None \
+            else "--"
+
+        self._stream.write(
+            "\n"
+            "*** # Results on 1: %s ***\n"
+            "*** # Results on 2: %s ***\n"
+            "*** # Equal results: %s ***\n"
+            "*** # Different results: %s ***\n"
+            "*** Avg time for equal results (1): %s ***\n"
+            "*** Avg time for equal resutls (2): %s ***\n" %
+            (summary.num_results1, summary.num_results2, summary.num_equal,
+             summary.num_different, avg_time1, avg_time2))
+
+    def write_estimates(self, population, sample_size, estimates):
+        self._stream.write(
+            "\n"
+            "*** Estimates over %s instances from a sample of %s "
+            "(95%% CI) ***\n" % (population, sample_size))
+        for e in estimates:
+            self._stream.write("*** %s: %.4f [%.4f, %.4f] ***\n" %
+                               (e.metric, e.value, e.ci_low, e.ci_high))
+
+    def _write_attr_values(self, attr_values):
+        for attr, val_1, val_2 in attr_values:
+            self._stream.write("*** %s\n   -- 1: %s\n   -- 2: %s\n" %
+                               (attr, val_1, val_2))
+
+
+################################
+#   JSON Lines Report Writer   #
+################################
+
+class JsonLinesReportWriter(AbstractReportWriter):
+    """One JSON object per line, the one with status 'summary' holds the
+    summary and the one with status 'estimate', if any, the estimates.
+    """
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        import json
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def write_equal(self, instance, attr_values):
+        self._write_record(instance, STATUS_EQUAL, attr_values)
+
+    def write_different(self, instance, attr_values):
+        self._write_record(instance, STATUS_DIFFERENT, attr_values)
+
+    def write_only_in(self, instance, status):
+        self._write_record(instance, status, ())
+
+    def write_summary(self, summary):
+        record = collections.OrderedDict(status=STATUS_SUMMARY)
+        record.update(summary._asdict())
+        self._stream.write(self._encoder.encode(record))
+        self._stream.write("\n")
+
+    def write_estimates(self, population, sample_size, estimates):
+        record = collections.OrderedDict(
+            (('status', STATUS_ESTIMATE), ('population', population),
+             ('sample_size', sample_size),
+             ('estimates', {e.metric: [e.value, e.ci_low, e.ci_high]
+                            for e in estimates})))
+        self._stream.write(self._encoder.encode(record))
+        self._stream.write("\n")
+
+    def _write_record(self, instance, status, attr_values):
+        record = collections.OrderedDict(
+            (('instance', instance), ('status', status),
+             ('fields', {attr: [val_1, val_2]
+                         for attr, val_1, val_2 in attr_values})))
+        self._stream.write(self._encoder.encode(record))
+        self._stream.write("\n")
+
+
+#########################
+#   CSV Report Writer   #
+#########################
+
+class CsvReportWriter(AbstractReportWriter):
+    """One row per reported field of each instance, with the values of the
+    field in both results, or a single row without field if there are none.
+    The summary is written at the end as rows with status 'summary', whose
+    field is the summary entry, e.g., 'avg_time' with the values of both
+    results, or 'num_equal' with a single value. The estimates are written
+    likewise with status 'estimate', a row with the value of each metric and
+    a '<metric>_ci' row with its 95% confidence interval bounds.
+    """
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        import csv
+        self._writer = csv.writer(stream)
+        self._writer.writerow(('instance', 'status', 'field', 'value1',
+                               'value2'))
+
+    def write_equal(self, instance, attr_values):
+        self._write_rows(instance, STATUS_EQUAL, attr_values)
+
+    def write_different(self, instance, attr_values):
+        self._write_rows(instance, STATUS_DIFFERENT, attr_values)
+
+    def write_only_in(self, instance, status):
+        self._write_rows(instance, status, ())
+
+    def write_summary(self, summary):
+        self._writer.writerows((
+            ('', STATUS_SUMMARY, 'num_results', summary.num_results1,
+             summary.num_results2),
+            ('', STATUS_SUMMARY, 'num_equal', summary.num_equal, ''),
+            ('', STATUS_SUMMARY, 'num_different', summary.num_different, ''),
+            ('', STATUS_SUMMARY, 'avg_time', summary.avg_time1,
+             summary.avg_time2),
+        ))
+
+    def write_estimates(self, population, sample_size, estimates):
+        self._writer.writerow(('', STATUS_ESTIMATE, 'population', population,
+                               ''))
+        self._writer.writerow(('', STATUS_ESTIMATE, 'sample_size',
+                               sample_size, ''))
+        for e in estimates:
+            self._writer.writerow(('', STATUS_ESTIMATE, e.metric, e.value, ''))
+            self._writer.writerow(('', STATUS_ESTIMATE, e.metric + '_ci',
+                                   e.ci_low, e.ci_high))
+
+    def _write_rows(self, instance, status, attr_values):
+        if not attr_values:
+            self._writer.writerow((instance, status, '', '', ''))
+        for attr, val_1, val_2 in attr_values:
+            self._writer.writerow((instance, status, attr, val_1, val_2))
+
+
+_report_writers = {
+    REPORT_FORMAT_TEXT: TextReportWriter,
+    REPORT_FORMAT_JSONL: JsonLinesReportWriter,
+    REPORT_FORMAT_CSV: CsvReportWriter,
+}
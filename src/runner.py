@@ -4,13 +4,17 @@ from collections import namedtuple
 from concurrent.futures import ProcessPoolExecutor
 from concurrent.futures.process import BrokenProcessPool
 from signal import SIGKILL
-from subprocess import Popen, DEVNULL, PIPE
-from threading import Timer
+from subprocess import Popen, DEVNULL, PIPE, SubprocessError
+from threading import Condition, Timer
 
 import errno
+import itertools
 import os
 
 import osutils
+import parsers
+from archive import compress_output
+from cgroups import JobCgroup, ResourceUsage, UNKNOWN_USAGE
 
 if osutils.is_windows():
     import ctypes
@@ -27,7 +31,9 @@ BrokenPoolException = BrokenProcessPool
 
 RunnerResult = namedtuple(
     'RunnerResult',
-    ['instance', 'exit_status', 'output', 'timeout', 'cpu_time', 'sys_time']
+    ['instance', 'exit_status', 'output', 'timeout', 'cpu_time', 'sys_time',
+     'peak_memory', 'read_bytes', 'write_bytes', 'parsed',
+     'compressed_output']
 )
 
 
@@ -36,33 +42,111 @@ RunnerResult = namedtuple(
 
 class Runner:
 
-    def __init__(self, n_jobs, timeout):
+    def __init__(self, n_jobs, timeout, parser=None,
+                 keep_output=parsers.KEEP_OUTPUT_ALWAYS, max_pending=None,
+                 cgroup=None, archive_output=False):
+        """
+        :param n_jobs: Maximum number of parallel executions.
+        :param timeout: Executions timeout in seconds.
+        :param parser: Name of the parser used to parse the solver output
+                       in the worker processes. If None the output is not
+                       parsed and it is always returned.
+        :param keep_output: Policy to decide whether the raw output is
+                            returned along with the parsed result.
+        :param max_pending: Maximum number of submitted executions that have
+                            not finished yet when using `run_all`. Defaults
+                            to twice the number of jobs.
+        :param cgroup: Parent cgroup v2 directory where each execution gets
+                       its own cgroup to account for the resources of all
+                       its processes. If None, or the cgroup cannot be
+                       created, only the solver process is accounted for.
+        :param archive_output: Whether the whole output is also returned
+                               compressed, regardless of `keep_output`, to
+                               be archived.
+        """
         self._executor = ProcessPoolExecutor(max_workers=n_jobs)
         self._timeout = timeout
+        self._parser = parser
+        self._keep_output = keep_output if parser \
+            else parsers.KEEP_OUTPUT_ALWAYS
+        self._cgroup = cgroup
+        self._archive_output = archive_output
         self._done_callbacks = []
         self._id = 0
 
-    def run(self, solver, instance, parameters):
+        self._max_pending = max_pending or 2 * n_jobs
+        self._pending = set()
+        self._pending_cond = Condition()
+
+    def run(self, solver, instance, parameters, timeout=None, tag=None):
+        """Submits the execution of solver on instance.
+
+        :param timeout: Timeout of this execution, if None the runner
+                        timeout is used.
+        :param tag: Value stored in the returned future `tag` attribute,
+                    which is available to the done callbacks.
+        """
+        timeout = self._timeout if timeout is None else timeout
         f = self._executor.submit(_execute_solver, solver, instance,
-                                  parameters, self._timeout)
+                                  parameters, timeout, self._parser,
+                                  self._keep_output, self._cgroup,
+                                  self._archive_output)
         f.id = self._next_id()
+        f.tag = tag
+
+        with self._pending_cond:
+            self._pending.add(f)
         for fn in self._done_callbacks:
             f.add_done_callback(fn)
+        f.add_done_callback(self._remove_pending)
 
         return f
 
+    def run_all(self, jobs):
+        """Submits the executions lazily, keeping at most `max_pending` of
+        them unfinished. Returns once all the jobs have been submitted.
+
+        :param jobs: Iterable of tuples with the `run` arguments.
+        :return: The number of submitted jobs.
+        """
+        count = 0
+        for job in jobs:
+            with self._pending_cond:
+                while len(self._pending) >= self._max_pending:
+                    self._pending_cond.wait()
+            self.run(*job)
+            count += 1
+        return count
+
+    def cancel(self):
+        """Cancels the submitted executions that have not started yet."""
+        with self._pending_cond:
+            pending = list(self._pending)
+        for f in pending:
+            f.cancel()
+
     def add_done_callback(self, fn):
         self._done_callbacks.append(fn)
 
     def shutdown(self, wait=True):
         self._executor.shutdown(wait=wait)
 
+    def _remove_pending(self, future):
+        with self._pending_cond:
+            self._pending.discard(future)
+            self._pending_cond.notify()
+
     def _next_id(self):
         self._id += 1
         return self._id
 
 
-def _execute_solver(binary, instance, parameters, timeout):
+# Counter used to name the job cgroups of each worker process
+_job_counter = itertools.count()
+
+
+def _execute_solver(binary, instance, parameters, timeout, parser_name,
+                    keep_output, cgroup_parent, archive_output=False):
     command = [binary]
     command.extend(parameters)
     command.append(instance)
@@ -70,12 +154,12 @@ def _execute_solver(binary, instance, parameters, timeout):
     old_cwd = os.getcwd()
     os.chdir(os.path.dirname(os.path.abspath(binary)))
 
-    p, handle = _start_runner_subprocess(command)
+    p, handle, job_cgroup = _start_runner_subprocess(command, cgroup_parent)
 
     p.timeout = False
-    output, cpu_time, sys_time = "", -1, -1
+    output = ""
 
-    t = Timer(timeout, _timeout_callback, [p])
+    t = Timer(timeout, _timeout_callback, [p, job_cgroup])
     t.start()
 
     try:
@@ -87,17 +171,31 @@ def _execute_solver(binary, instance, parameters, timeout):
         t.cancel()
         t.join()
 
-    if not p.timeout:
-        cpu_time, sys_time = _wait_and_get_execution_time(handle)
+    usage = _wait_and_get_resource_usage(handle)
+    if job_cgroup is not None:
+        usage = _merge_resource_usage(job_cgroup.read_usage(), usage)
+        job_cgroup.remove()
 
     os.chdir(old_cwd)
 
+    compressed_output = compress_output(output) if archive_output else None
+
+    parsed = None
+    if parser_name and not p.timeout:
+        parsed = parsers.create_parser(parser_name).parse(output)
+    if not parsers.must_keep_output(keep_output, p.timeout, parsed):
+        output = ""
+
     return RunnerResult(instance=instance, exit_status=p.returncode,
                         output=output, timeout=p.timeout,
-                        cpu_time=cpu_time, sys_time=sys_time)
+                        cpu_time=usage.cpu_time, sys_time=usage.sys_time,
+                        peak_memory=usage.peak_memory,
+                        read_bytes=usage.read_bytes,
+                        write_bytes=usage.write_bytes, parsed=parsed,
+                        compressed_output=compressed_output)
 
 
-def _timeout_callback(process):
+def _timeout_callback(process, job_cgroup):
     if process.poll() is None:
         try:
             print("Killing")
@@ -111,16 +209,40 @@ def _timeout_callback(process):
             if e.errno != errno.ESRCH:
                 raise
 
+    # Processes that left the solver process group
+    if job_cgroup is not None:
+        job_cgroup.kill()
+
 
 ##############################################################################
 # OS Utility functions
 ##############################################################################
 
-def _start_runner_subprocess(command):
+def _start_runner_subprocess(command, cgroup_parent=None):
+    job_cgroup = None
+    if cgroup_parent is not None:
+        try:
+            job_cgroup = JobCgroup(cgroup_parent, 'job-{0}-{1}'.format(
+                os.getpid(), next(_job_counter)))
+        except OSError:
+            pass
+
+    if job_cgroup is not None:
+        try:
+            p = _popen(command, job_cgroup.attach_current_process)
+            return p, _get_subprocess_handle(p), job_cgroup
+        except SubprocessError:  # Cannot move the process into the cgroup
+            job_cgroup.remove()
+
+    p = _popen(command)
+    return p, _get_subprocess_handle(p), None
+
+
+def _popen(command, preexec_fn=None):
     # Use text pipelines
-    p = Popen(command, stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL,
-              universal_newlines=True, start_new_session=True)
-    return p, _get_subprocess_handle(p)
+    return Popen(command, stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL,
+                 universal_newlines=True, start_new_session=True,
+                 preexec_fn=preexec_fn)
 
 
 def _get_subprocess_handle(process):
@@ -136,18 +258,35 @@ def _get_subprocess_handle(process):
         raise NotImplementedError("Your OS is not supported")
 
 
-def _wait_and_get_execution_time(handle):
+def _wait_and_get_resource_usage(handle):
     if osutils.is_posix():
-        return _posix_wait_and_get_execution_time(handle)
+        return _posix_wait_and_get_resource_usage(handle)
     elif osutils.is_windows():
-        return _windows_wait_and_get_execution_time(handle)
+        utime, stime = _windows_wait_and_get_execution_time(handle)
+        return ResourceUsage(cpu_time=utime, sys_time=stime, peak_memory=-1,
+                             read_bytes=-1, write_bytes=-1)
     else:
         raise NotImplementedError("Your OS is not supported")
 
 
-def _posix_wait_and_get_execution_time(handle):
-    _, _, rusage = os.wait4(handle, 0)
-    return rusage.ru_utime, rusage.ru_stime
+def _merge_resource_usage(preferred, fallback):
+    """Takes the known values of preferred and the rest from fallback."""
+    return ResourceUsage(*(p if p >= 0 else f
+                           for p, f in zip(preferred, fallback)))
+
+
+def _posix_wait_and_get_resource_usage(handle):
+    try:
+        _, _, rusage = os.wait4(handle, 0)
+    except ChildProcessError:  # Already reaped by Popen.poll
+        return UNKNOWN_USAGE
+
+    # ru_maxrss is in KiB on Linux but in bytes on Mac OS
+    maxrss_unit = 1 if osutils.is_mac() else 1024
+    return ResourceUsage(cpu_time=rusage.ru_utime, sys_time=rusage.ru_stime,
+                         peak_memory=rusage.ru_maxrss * maxrss_unit,
+                         read_bytes=rusage.ru_inblock * 512,
+                         write_bytes=rusage.ru_oublock * 512)
 
 
 def _windows_wait_and_get_execution_time(handle):
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Stratified sampling of the instances, to evaluate a small representative
+# subset of them and estimate the metrics of the whole set.
+#
+
+import math
+import os
+import random
+
+
+########################
+#   Module Constants   #
+########################
+
+SOLUTION_CLASS_SAT = 'SAT'
+SOLUTION_CLASS_UNSAT = 'UNSAT'
+SOLUTION_CLASS_INDETERMINATE = 'INDETERMINATE'
+
+_SOLUTION_CLASSES = {
+    'SATISFIABLE': SOLUTION_CLASS_SAT,
+    'OPTIMUM FOUND': SOLUTION_CLASS_SAT,
+    'UNSATISFIABLE': SOLUTION_CLASS_UNSAT,
+}
+
+# Group of the instances that are not in a sub-directory
+ROOT_GROUP = '.'
+
+# Instances sampled from each stratum at least, if it has that many, so that
+# its variance can be estimated
+MIN_STRATUM_SAMPLE = 2
+
+# Normal quantile of the 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+_ALLOCATION_ITERATIONS = 50
+
+
+################
+#   Strata     #
+################
+
+def get_stratum_key(name, result):
+    """Returns the stratum of an instance given its baseline result.
+
+    Strata are defined by the top-level directory of the instance, the class
+    of its solution (SAT, UNSAT or INDETERMINATE) and the power of two bucket
+    of its cpu time, e.g., 'family|SAT|t3' for times in [4, 8) seconds.
+    """
+    group = name.split(os.sep, 1)[0] if os.sep in name else ROOT_GROUP
+    solution_class = _SOLUTION_CLASSES.get(result.solution,
+                                           SOLUTION_CLASS_INDETERMINATE)
+    if result.cpu_time < 0:
+        bucket = 'tx'
+    elif result.cpu_time < 1:
+        bucket = 't0'
+    else:
+        bucket = 't{0}'.format(int(math.log2(result.cpu_time)) + 1)
+
+    return "|".join((group, solution_class, bucket))
+
+
+def draw_stratified_sample(baseline, budget, seed=0, unknown_cost=0.0):
+    """Draws a stratified sample of the baseline instances.
+
+    Every stratum is sampled with the same fraction (proportional allocation),
+    the largest one whose expected cost, the sum of the baseline cpu times of
+    the sampled instances, fits in the budget. Each stratum contributes
+    MIN_STRATUM_SAMPLE instances at least, even if that exceeds the budget.
+
+    :param baseline: Mapping, instance name -> CompleteSolverResult.
+    :param budget: Cost budget in cpu seconds.
+    :param seed: Seed of the random selection.
+    :param unknown_cost: Cost of the instances without a valid cpu time.
+    :return: A tuple (strata, cost), where strata is a list of
+             (key, population, instances) tuples sorted by key.
+    """
+    population = {}
+    for name, result in baseline.items():
+        population.setdefault(get_stratum_key(name, result), []).append(name)
+
+    rnd = random.Random(seed)
+    shuffled = []  # (key, instances in random order, cumulative costs)
+    for key in sorted(population):
+        names = sorted(population[key])
+        rnd.shuffle(names)
+        costs, total = [], 0.0
+        for name in names:
+            cpu_time = baseline[name].cpu_time
+            total += cpu_time if cpu_time >= 0 else unknown_cost
+            costs.append(total)
+        shuffled.append((key, names, costs))
+
+    def allocate(fraction):
+        sizes = [min(len(names), max(MIN_STRATUM_SAMPLE,
+                                     int(round(fraction * len(names)))))
+                 for _, names, _ in shuffled]
+        cost = sum(costs[size - 1]
+                   for (_, _, costs), size in zip(shuffled, sizes))
+        return sizes, cost
+
+    sizes, cost = allocate(1.0)
+    if cost > budget:
+        low, high = 0.0, 1.0
+        sizes, cost = allocate(low)
+        for _ in range(_ALLOCATION_ITERATIONS):
+            middle = (low + high) / 2
+            middle_sizes, middle_cost = allocate(middle)
+            if middle_cost <= budget:
+                low, sizes, cost = middle, middle_sizes, middle_cost
+            else:
+                high = middle
+
+    strata = [(key, len(names), sorted(names[:size]))
+              for (key, names, _), size in zip(shuffled, sizes)]
+    return strata, cost
+
+
+##################
+#   Estimation   #
+##################
+
+def estimate_mean(strata, values):
+    """Estimates the population mean of a per-instance value.
+
+    Strata without any observed value are left out of the population. The
+    variance of strata with a single observed value is taken as zero.
+
+    :param strata: List of (key, population, instances) tuples.
+    :param values: Mapping, instance name -> value, of the observed sampled
+                   instances.
+    :return: A tuple (mean, ci_low, ci_high) with the 95% confidence
+             interval, or None if there are no observed values.
+    """
+    observed = []  # (population, stratum values)
+    for _, stratum_population, instances in strata:
+        stratum_values = [values[i] for i in instances if i in values]
+        if stratum_values:
+            observed.append((stratum_population, stratum_values))
+
+    total_population = sum(p for p, _ in observed)
+    if not total_population:
+        return None
+
+    mean, variance = 0.0, 0.0
+    for stratum_population, stratum_values in observed:
+        n = len(stratum_values)
+        weight = stratum_population / total_population
+        stratum_mean = sum(stratum_values) / n
+        mean += weight * stratum_mean
+        if n > 1:
+            s2 = sum((v - stratum_mean) ** 2 for v in stratum_values) / (n - 1)
+            variance += weight ** 2 * (1 - n / stratum_population) * s2 / n
+
+    half_width = CONFIDENCE_Z * math.sqrt(variance)
+    return mean, mean - half_width, mean + half_width
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Parsers of the bundled solvers. To support a new solver add a
+# SpecSolverParser subclass here and register it in parsers._BUILTIN_PARSERS.
+#
+
+from specparser import FieldSpec, SpecSolverParser, AGGREGATE_LAST
+
+
+# Common patterns
+##############################################################################
+
+# DIMACS solution line, e.g., "s SATISFIABLE"
+_SOLUTION_LINE = \
+    r's[ \t]+(OPTIMUM FOUND|(?:UN)?SATISFIABLE|UNKNOWN|INDETERMINATE)\b'
+
+# MaxSAT cost of the best solution found so far, e.g., "o 42"
+_OPTIMUM_LINE = r'o[ \t]+(-?\d+)'
+
+
+def _statistics_specs(line_prefix):
+    """Specs of the counters reported as "<prefix>name<sep> value" lines,
+    where the separator is a colon optionally surrounded by blanks.
+    """
+    return [
+        FieldSpec(field, line_prefix + name + r'[ \t]*:[ \t]*(\d+)')
+        for field, name in (('conflicts', 'conflicts'),
+                            ('decisions', 'decisions'),
+                            ('propagations', 'propagations'),
+                            ('restarts', 'restarts'))
+    ]
+
+
+# SAT Solvers
+##############################################################################
+
+class MiniSatParser(SpecSolverParser):
+
+    specs = _statistics_specs(r'[ \t]*') + [
+        FieldSpec('solution',
+                  r'(?:s[ \t]+)?(INDETERMINATE|(?:UN)?SATISFIABLE)\b', str),
+    ]
+
+
+class _DimacsStatisticsParser(SpecSolverParser):
+    """Solvers that report their statistics as comment lines and the
+    solution with an "s" line.
+    """
+
+    specs = _statistics_specs(r'c[ \t]+') + [
+        FieldSpec('solution', _SOLUTION_LINE, str),
+    ]
+
+
+class GlucoseParser(_DimacsStatisticsParser):
+    pass
+
+
+class CaDiCaLParser(_DimacsStatisticsParser):
+    pass
+
+
+class KissatParser(_DimacsStatisticsParser):
+    pass
+
+
+# MaxSAT Solvers
+##############################################################################
+
+class MaxSatParser(SpecSolverParser):
+    """MaxSAT Evaluation output format. The optimum is the cost of the last
+    reported solution, which is the best one found.
+    """
+
+    specs = [
+        FieldSpec('optimum', _OPTIMUM_LINE, int, AGGREGATE_LAST),
+        FieldSpec('solution', _SOLUTION_LINE, str),
+    ]
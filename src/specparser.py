@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Declarative solver output parsers.
+#
+# A parser is described by a list of FieldSpec, each one stating which
+# ParserSolverResult field is extracted by which pattern. All the patterns
+# of a parser are compiled into a single scanner that goes over the solver
+# output only once.
+#
+
+import collections
+import re
+
+from parsers import AbstractSolverParser, ParserSolverResult
+
+
+#################
+#   FieldSpec   #
+#################
+
+AGGREGATE_FIRST = 'first'
+AGGREGATE_LAST = 'last'
+AGGREGATE_MAX = 'max'
+AGGREGATE_MIN = 'min'
+
+AGGREGATE_CHOICES = (AGGREGATE_FIRST, AGGREGATE_LAST,
+                     AGGREGATE_MAX, AGGREGATE_MIN)
+
+
+_FieldSpec = collections.namedtuple(
+    '_FieldSpec',
+    ['field', 'pattern', 'type', 'aggregate']
+)
+
+
+class FieldSpec(_FieldSpec):
+    """Extraction rule of a ParserSolverResult field.
+
+    :param field: Name of the ParserSolverResult field.
+    :param pattern: Regular expression with exactly one capturing group, the
+                    value of the field. Patterns are matched at the beginning
+                    of a line and must not match line breaks.
+    :param type: Callable that converts the captured text into the value.
+    :param aggregate: How multiple matches are combined: 'first', 'last',
+                      'max' or 'min'.
+    """
+
+    def __new__(cls, field, pattern, type=int, aggregate=AGGREGATE_FIRST):
+        if field not in ParserSolverResult._fields:
+            raise ValueError("Unknown result field '%s'" % field)
+        if aggregate not in AGGREGATE_CHOICES:
+            raise ValueError("Unknown aggregate '%s'" % aggregate)
+        if re.compile(pattern).groups != 1:
+            raise ValueError("Pattern '%s' must have exactly one capturing "
+                             "group" % pattern)
+
+        return super().__new__(cls, field, pattern, type, aggregate)
+
+
+# Value of the fields that are not found in the output
+_DEFAULT_VALUES = {
+    'conflicts': -1,
+    'decisions': -1,
+    'optimum': -1,
+    'propagations': -1,
+    'restarts': -1,
+    'solution': "",
+}
+
+
+###############
+#   Scanner   #
+###############
+
+class _Scanner:
+    """Single pass matcher of a list of FieldSpec.
+
+    The patterns are combined into one alternation preceded by a line break,
+    which lets the regex engine skip quickly to the candidate positions. The
+    first line is checked on its own with the same alternation.
+    """
+
+    def __init__(self, specs):
+        alternatives, self._specs_by_group, group = [], {}, 1
+        for spec in specs:
+            alternatives.append('(%s)' % spec.pattern)
+            self._specs_by_group[group] = spec
+            group += 2  # Enclosing group + the value group
+
+        alternation = '(?:' + '|'.join(alternatives) + ')'
+        self._first_line_re = re.compile(alternation)
+        self._scan_re = re.compile('\n' + alternation)
+
+        self._specs = specs
+        self._all_first = all(s.aggregate == AGGREGATE_FIRST for s in specs)
+
+    def scan(self, text):
+        """Returns a dictionary with the aggregated value of each field."""
+        values = {}
+        pending = set(s.field for s in self._specs)
+
+        first_match = self._first_line_re.match(text)
+        if first_match:
+            self._update(values, pending, first_match)
+
+        for m in self._scan_re.finditer(text):
+            if self._all_first and not pending:
+                break
+            self._update(values, pending, m)
+
+        return values
+
+    def _update(self, values, pending, match):
+        spec = self._specs_by_group[match.lastindex]
+        field, aggregate = spec.field, spec.aggregate
+        if aggregate == AGGREGATE_FIRST and field not in pending:
+            return
+
+        value = spec.type(match.group(match.lastindex + 1))
+        if field not in values or aggregate == AGGREGATE_LAST:
+            values[field] = value
+        elif aggregate == AGGREGATE_MAX:
+            values[field] = max(values[field], value)
+        elif aggregate == AGGREGATE_MIN:
+            values[field] = min(values[field], value)
+        pending.discard(field)
+
+
+##########################
+#   Spec Solver Parser   #
+##########################
+
+class SpecSolverParser(AbstractSolverParser):
+    """Parser driven by the FieldSpec list in the `specs` class attribute.
+
+    Subclasses only have to define `specs`, the scanner is built the first
+    time the parser is used and it is shared by all the instances.
+    """
+
+    specs = []
+
+    def __init__(self):
+        self._values = dict(_DEFAULT_VALUES)
+
+    @classmethod
+    def _get_scanner(cls):
+        scanner = cls.__dict__.get('_scanner')
+        if scanner is None:
+            scanner = _Scanner(cls.specs)
+            cls._scanner = scanner
+        return scanner
+
+    @property
+    def conflicts(self):
+        return self._values['conflicts']
+
+    @property
+    def decisions(self):
+        return self._values['decisions']
+
+    @property
+    def optimum(self):
+        return self._values['optimum']
+
+    @property
+    def propagations(self):
+        return self._values['propagations']
+
+    @property
+    def restarts(self):
+        return self._values['restarts']
+
+    @property
+    def solution(self):
+        return self._values['solution']
+
+    def parse(self, text):
+        self._values.update(self._get_scanner().scan(text))
+        return self.get_result()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Staging of instances into a local (fast) directory, e.g., /dev/shm, so that
+# the solvers do not read them from slow or shared file systems.
+#
+
+import importlib
+import os
+import os.path
+import queue
+import shutil
+import tempfile
+import threading
+
+
+########################
+#   Module Constants   #
+########################
+
+# Decompressors by file extension, the modules are imported when needed
+_DECOMPRESSORS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'lzma',
+    '.lzma': 'lzma',
+}
+
+_END = object()
+
+
+######################
+#   InstanceStager   #
+######################
+
+class InstanceStager:
+    """Copies the instances into a staging directory ahead of their use.
+
+    A prefetch thread stages the instances, in order, as long as the staged
+    files fit in the size budget and there are at most `max_ahead` of them
+    waiting to be used. Iterating over the stager yields the pairs
+    (instance, staged_path). Once a staged file has been used `uses` times,
+    as notified through `release`, it is deleted.
+
+    If an instance cannot be staged its original path is yielded instead.
+    """
+
+    def __init__(self, instances, stage_dir, budget_bytes, max_ahead=16,
+                 uses=1, decompress=False):
+        """
+        :param instances: Iterable of instance paths.
+        :param stage_dir: Directory where a temporary staging directory is
+                          created.
+        :param budget_bytes: Maximum size of the staged files. A file larger
+                             than the budget is staged when no other file is.
+        :param max_ahead: Maximum number of staged files not yet yielded.
+        :param uses: Number of releases required to delete a staged file.
+        :param decompress: Whether to decompress .gz, .bz2, .xz and .lzma
+                           instances while staging them.
+        """
+        self._instances = instances
+        self._dir = tempfile.mkdtemp(prefix='diffsolver-',
+                                     dir=os.path.abspath(stage_dir))
+        self._budget = budget_bytes
+        self._uses = uses
+        self._decompress = decompress
+
+        self._cond = threading.Condition()
+        self._queue = queue.Queue(maxsize=max_ahead)
+        self._staged = {}  # staged path -> [pending uses, size]
+        self._used_bytes = 0
+        self._closed = False
+        self._count = 0
+
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            yield item
+
+    def release(self, staged_path):
+        """Notifies that a staged file has been used once."""
+        with self._cond:
+            entry = self._staged.get(staged_path)
+            if entry is None:
+                return
+            entry[0] -= 1
+            if entry[0] > 0:
+                return
+            del self._staged[staged_path]
+            self._used_bytes -= entry[1]
+            self._cond.notify_all()
+
+        _remove_file(staged_path)
+
+    def close(self):
+        """Stops the prefetching and deletes all the staged files."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        # Unblock the prefetch thread if it is waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _prefetch(self):
+        try:
+            for path in self._instances:
+                try:
+                    size = os.path.getsize(path)
+                except OSError as e:
+                    print("Cannot stage", path, "using it in place:", e)
+                    self._queue.put((path, path))
+                    continue
+
+                with self._cond:
+                    while not self._closed and self._used_bytes > 0 and \
+                            self._used_bytes + size > self._budget:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    self._used_bytes += size
+
+                self._queue.put((path, self._stage(path, size)))
+        finally:
+            self._queue.put(_END)
+
+    def _stage(self, path, reserved_size):
+        self._count += 1
+        name = os.path.basename(path)
+        root, ext = os.path.splitext(name)
+        module_name = _DECOMPRESSORS.get(ext) if self._decompress else None
+        staged_path = os.path.join(
+            self._dir, "{0}-{1}".format(self._count,
+                                        root if module_name else name))
+
+        try:
+            if module_name:
+                module = importlib.import_module(module_name)
+                with module.open(path, 'rb') as src, \
+                        open(staged_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+            else:
+                shutil.copyfile(path, staged_path)
+            size = os.path.getsize(staged_path)
+        except (IOError, OSError, EOFError) as e:
+            print("Cannot stage", path, "using it in place:", e)
+            _remove_file(staged_path)
+            with self._cond:
+                self._used_bytes -= reserved_size
+                self._cond.notify_all()
+            return path
+
+        with self._cond:
+            self._used_bytes += size - reserved_size
+            self._staged[staged_path] = [self._uses, size]
+        return staged_path
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,74 @@
+#!/usr/bin/env bash
+#
+# Checks that the CLI start up stays within a time budget. It measures the
+# average wall time of the '--version' and 'diff' sub-commands.
+#
+# Usage: startup_time.sh [diffsolver.py|diffsolver.pyz] [budget_ms] [runs]
+#
+
+# Python interpreter executable
+PYTHON=python3
+
+DIFFSOLVER=${1:-`dirname "$0"`/../src/diffsolver.py}
+BUDGET_MS=${2:-150}
+RUNS=${3:-20}
+
+
+# Temporary results files for the diff sub-command
+################################################################################
+
+tmpdir=`mktemp -d`
+trap 'rm -rf "$tmpdir"' EXIT
+
+cat > "$tmpdir/a.results" <<EOF
+<results>
+    <result>
+        <instance>a.cnf</instance>
+        <conflicts>1</conflicts>
+        <decisions>2</decisions>
+        <optimum>-1</optimum>
+        <propagations>3</propagations>
+        <restarts>4</restarts>
+        <solution>SATISFIABLE</solution>
+        <cpu_time>0.5</cpu_time>
+    </result>
+</results>
+EOF
+cp "$tmpdir/a.results" "$tmpdir/b.results"
+
+
+# Measure
+################################################################################
+
+# Average wall time, in milliseconds, of running diffsolver with the given args
+measure() {
+    local start end
+    start=`date +%s%N`
+    for ((i = 0; i < RUNS; i++)); do
+        $PYTHON "$DIFFSOLVER" "$@" > /dev/null || return 1
+    done
+    end=`date +%s%N`
+    echo $(( (end - start) / RUNS / 1000000 ))
+}
+
+status=0
+for cmd in "--version" "diff"; do
+    if [ "$cmd" = "diff" ]; then
+        avg_ms=`measure diff -w "$tmpdir" "$tmpdir/a.results" \
+                                          "$tmpdir/b.results"`
+    else
+        avg_ms=`measure $cmd`
+    fi
+
+    if [ "$?" -ne 0 ]; then
+        echo "-- $cmd: failed"
+        status=1
+    elif [ "$avg_ms" -gt "$BUDGET_MS" ]; then
+        echo "-- $cmd: ${avg_ms}ms exceeds the ${BUDGET_MS}ms budget"
+        status=1
+    else
+        echo "++ $cmd: ${avg_ms}ms (budget ${BUDGET_MS}ms)"
+    fi
+done
+
+exit $status